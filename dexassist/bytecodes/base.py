@@ -34,11 +34,22 @@ SECTION_CODE = 16
 SECTION_CLASS_DATA = 17
 SECTION_MAP = 18
 
+def read_ints(insns, index, count):
+  """
+    uint list from code units, low half first
+  """
+  return [insns[x + 1] << 16 | insns[x] for x in range(index, index + count * 2, 2)]
+
 def translate_opcode(opcode):
   return OPCODE_TABLE[opcode][1]
 def translate_operand_type(opcode):
-  return OPCODE_TABLE[opcode][2]
+  return REF_TYPE_TABLE[opcode]
 class Instruction(object):
+  """
+    formats have __slots__ for operands, label is set on branch
+    (and switch, labels on switch payload) by editor
+  """
+  __slots__ = ('manager', 'op', 'label', 'unique_key')
 
   def need_access_instructions(self):
     return False
@@ -48,10 +59,13 @@ class Instruction(object):
     stream.write_ushort(val)
   @property
   def ref_type(self):
-    if len(OPCODE_TABLE[self.get_op()]) == 2: return -1
-    return OPCODE_TABLE[self.get_op()][2]
+    return REF_TYPE_TABLE[self.op]
   def get_code_unit_count(self):
-    return int(len(self) / 2)
+    width = WIDTH_TABLE[self.op]
+    if width:
+      return width
+    # nop or payload
+    return len(self) >> 1
   def __init__(self, manager):
     self.manager = manager
   def initialize(self):
@@ -59,35 +73,16 @@ class Instruction(object):
   def set_ref_item(self):
     pass
   def get_typeindex_item(self, opcode, index):
-    op_type = translate_operand_type(opcode)
-    if op_type == INSTRUCT_TYPE_STRING:
-      return self.manager.get_string_by_index(index)
-    elif op_type == INSTRUCT_TYPE_TYPE:
-      ret = self.manager.get_type(index)
-      if len(ret) > 1: return ret
-      if ret == 'v':
-        return 'void'
-      if ret == 'i':
-        return 'int'
-      return ret
-    elif op_type == INSTRUCT_TYPE_METHOD:
-      method = self.manager.get_method_dex_item_by_index(index)
-      return method
-    elif op_type == INSTRUCT_TYPE_FIELD:
-      return self.manager.get_field_dex_item_by_index(index)
-    elif op_type == INSTRUCT_TYPE_OFFSET:
-      return self.manager.get_offset_by_index(index)
-    elif op_type == INSTRUCT_TYPE_KIND:
-      return self.manager.get_kind_by_index(index)
-    elif op_type == INSTRUCT_TYPE_PROTO:
-      return self.manager.get_proto_dex_item_by_index(index)
-    elif op_type == INSTRUCT_TYPE_CALL_SITE:
-      return self.manager.get_site_item_by_index(index)
-    elif op_type == INSTRUCT_TYPE_METHOD_HANDLE:
-      return self.manager.get_method_handle_item_by_index(index)
+    op_type = REF_TYPE_TABLE[opcode]
+    if op_type == -1:
+      return None
+    resolver = ITEM_RESOLVERS[op_type]
+    if resolver is None:
+      return None
+    return resolver(self.manager, index)
 
   def get_section_type(self, opcode):
-    return OPCODE_TABLE[opcode][3]
+    return SECTION_TABLE[opcode]
   
   def __len__(self):
     raise Exception('length not defined')
@@ -107,14 +102,23 @@ class Instruction(object):
     pass
 
   def from_byte(self, stream):
-    raise Exception('from_byte not implemented')
+    """
+      decode from code stream, stream is moved to next opcode
+    """
+    self.from_insns(stream.buf, stream.index)
+    stream.index += len(self) >> 1
+
+  def from_insns(self, insns, index):
+    """
+      decode from code units(array('H')) at index
+    """
+    raise Exception('from_insns not implemented')
   def get_op(self):
     return self.op
   def op_as_byte(self):
     return bytes(self.get_op())
 
   def from_stream(self, stream):
-    self.base_offset = stream.offset
     ret = self.from_byte(stream)
     self.initialize()
     return ret
@@ -130,6 +134,7 @@ class Instruction(object):
 
 # N/A 	00x 	N/A
 class Instruction00x(Instruction):
+  __slots__ = ()
   def as_byte_stream(self):
     pass
   
@@ -144,6 +149,7 @@ class Instruction00x(Instruction):
 
 # ØØ|op 	10x 	op
 class Instruction10x(Instruction):
+  __slots__ = ('high', 'size', 'first_key', 'keys', 'targets', 'element_width', 'data', 'switch', 'labels')
   def as_byte_stream(self):
     pass
   def write_uint(self, stream, value):
@@ -177,39 +183,30 @@ class Instruction10x(Instruction):
     
   def from_string(self):
     pass
-  def from_byte(self, stream):
-    self.high = stream.read()
-    self.op = self.high & 0xff
-    self.high = self.high >> 8 & 0xff
-    #if self.high:
-    #  print('ident is {}'.format(self.high))
-
+  def from_insns(self, insns, index):
+    temp = insns[index]
+    self.op = temp & 0xff
+    self.high = temp >> 8 & 0xff
+    if self.high == 0:
+      return
+    size = insns[index + 1]
     if self.high == 1: # packed-switch-payload
-      self.size = stream.read()
-      self.first_key = stream.read_int()
-      self.targets = []
-      for x in range(self.size):
-        self.targets.append(stream.read_int())
+      self.size = size
+      self.first_key = insns[index + 3] << 16 | insns[index + 2]
+      self.targets = read_ints(insns, index + 4, size)
 
     if self.high == 2: # sparse-switch-payload
-      self.size = stream.read()
-      self.keys = []
-      self.targets = []
-      for x in range(self.size):
-        self.keys.append(stream.read_int())
-      for x in range(self.size):
-        self.targets.append(stream.read_int())
+      self.size = size
+      self.keys = read_ints(insns, index + 2, size)
+      self.targets = read_ints(insns, index + 2 + size * 2, size)
     if self.high == 3: # fill-array-data-payload
-      self.element_width = stream.read()
-      self.size = stream.read_int()
-      self.data = bytearray()
-      if (self.size * self.element_width) % 2 == 1:
+      self.element_width = size
+      self.size = insns[index + 3] << 16 | insns[index + 2]
+      data_size = self.size * self.element_width
+      if data_size % 2 == 1:
         raise Exception('element_width is not aligned')
-      read_size = 0
-      while read_size < self.size * self.element_width:
-        self.data += struct.pack(USHORT_FMT, stream.read())
-        read_size += 2
-      assert(len(self.data) == self.size * self.element_width)
+      self.data = bytearray(insns[index + 4 : index + 4 + data_size // 2].tobytes())
+      assert(len(self.data) == data_size)
 
       
   def __len__(self):
@@ -224,6 +221,7 @@ class Instruction10x(Instruction):
 
 # B|A|op 	12x 	op vA, vB
 class Instruction12x(Instruction):
+  __slots__ = ('A', 'B')
   def as_byte_stream(self):
     pass
   
@@ -237,8 +235,8 @@ class Instruction12x(Instruction):
   def from_string(self):
     pass
 
-  def from_byte(self, stream):
-    temp = stream.read()
+  def from_insns(self, insns, index):
+    temp = insns[index]
     self.B = temp >> 12 & 0xf
     self.A = temp >> 8 & 0xf
     self.op = temp & 0xff
@@ -248,11 +246,13 @@ class Instruction12x(Instruction):
 
 # B|A|op 	11n 	op vA, #+B
 class Instruction11n(Instruction12x):
+  __slots__ = ()
   def as_string(self):
     return '{} v{:1x}, #+{:1x}'.format(self.get_opcode_string(), self.A, self.B)
 
 # AA|op 	11x 	op vAA
 class Instruction11x(Instruction):
+  __slots__ = ('AA',)
   def as_byte_stream(self):
     pass
   
@@ -263,16 +263,24 @@ class Instruction11x(Instruction):
   def as_string(self): 
     return '{} v{:02x}'.format(self.get_opcode_string(), self.AA)
 
-  def from_byte(self, stream):
-    temp = stream.read()
+  def from_insns(self, insns, index):
+    temp = insns[index]
     self.AA = temp >> 8 & 0xff
     self.op = temp & 0xff
        
   def __len__(self):
     return 2
 
+class GotoInstruction(Instruction):
+  """
+    10t, 20t and 30t have the same slots,
+    editor changes form of goto by __class__
+  """
+  __slots__ = ('AA', 'AAAA', 'AAAAAAAA')
+
 # AA|op 	10t 	op +AA
-class Instruction10t(Instruction):
+class Instruction10t(GotoInstruction):
+  __slots__ = ()
   def as_byte_stream(self):
     pass
   
@@ -283,8 +291,8 @@ class Instruction10t(Instruction):
   def as_string(self):
     return '{} +{:02x}'.format(self.get_opcode_string(), self.AA)
 
-  def from_byte(self, stream):
-    temp = stream.read()
+  def from_insns(self, insns, index):
+    temp = insns[index]
     self.AA = temp >> 8 & 0xff
     self.op = temp & 0xff
 
@@ -292,7 +300,8 @@ class Instruction10t(Instruction):
     return 2   
 
 # ØØ|op AAAA 	20t 	op +AAAA
-class Instruction20t(Instruction):
+class Instruction20t(GotoInstruction):
+  __slots__ = ()
   def as_byte_stream(self):
     pass
   
@@ -304,15 +313,16 @@ class Instruction20t(Instruction):
   def as_string(self):
     return '{} +{:04x}'.format(self.get_opcode_string(), self.AAAA)
 
-  def from_byte(self, stream):
-    self.op = stream.read() & 0xff
-    self.AAAA = stream.read()
+  def from_insns(self, insns, index):
+    self.op = insns[index] & 0xff
+    self.AAAA = insns[index + 1]
         
   def __len__(self):
     return 4
 
 # AA|op BBBB 	20bc 	op AA, kind@BBBB
 class Instruction20bc(Instruction):
+  __slots__ = ('AA', 'BBBB')
   def as_byte_stream(self):
     pass
   
@@ -328,11 +338,11 @@ class Instruction20bc(Instruction):
     str = '{} {:02x}, '.format(self.get_opcode_string(), self.AA) + self.BBBB.name
     return str
 
-  def from_byte(self, stream):
-    temp = stream.read()
-    self.AA = temp >> 8  &0xff
+  def from_insns(self, insns, index):
+    temp = insns[index]
+    self.AA = temp >> 8 & 0xff
     self.op = temp & 0xff
-    self.BBBB = stream.read()
+    self.BBBB = insns[index + 1]
         
   def __len__(self):
     return 4         
@@ -340,6 +350,7 @@ class Instruction20bc(Instruction):
 
 # AA|op BBBB 	22x 	op vAA, vBBBB
 class Instruction22x(Instruction):
+  __slots__ = ('AA', 'BBBB')
   def as_byte_stream(self):
     pass
   
@@ -351,27 +362,29 @@ class Instruction22x(Instruction):
   def as_string(self):
     return '{} v{:02x}, v{:04x}'.format(self.get_opcode_string(), self.AA, self.BBBB)    
 
-  def from_byte(self, stream):
-    temp = stream.read()
+  def from_insns(self, insns, index):
+    temp = insns[index]
     self.AA = temp >> 8 & 0xff
     self.op = temp & 0xff
-    self.BBBB = stream.read()
-    #print('BBBB : {:04x}'.format(self.BBBB))
+    self.BBBB = insns[index + 1]
   def __len__(self):
     return 4        
 # AA|op BBBB    21t	    op vAA, +BBBB
 class Instruction21t(Instruction22x):
+  __slots__ = ()
   def as_string(self):
     return '{} v{:02x}, +{:04x}'.format(self.get_opcode_string(), self.AA, self.BBBB) 
 
 # AA|op BBBB    21s	    op vAA, #+BBBB    
 class Instruction21s(Instruction22x):
+  __slots__ = ()
   def as_string(self):
     return '{} v{:02x}, #+{:04x}'.format(self.get_opcode_string(), self.AA, self.BBBB)
 
 # AA|op BBBB    21h	    op vAA, #+BBBB0000
 #                  	    op vAA, #+BBBB000000000000
 class Instruction21h(Instruction22x):
+  __slots__ = ()
   def as_string(self):
     return { 0x15 :  '{} v{:02x}, #+{:04x}0000'.format(self.get_opcode_string(), self.AA, self.BBBB),
            0x19 : '{} v{:02x}, #+{:04x}000000000000'.format(self.get_opcode_string(), self.AA, self.BBBB)
@@ -383,6 +396,7 @@ class Instruction21h(Instruction22x):
 #                               proto@BBBB
 #                               string@BBBB
 class Instruction21c(Instruction22x):
+  __slots__ = ()
   def set_ref_item(self):
     self.BBBB = self.get_typeindex_item(self.op, self.BBBB)
 
@@ -407,7 +421,7 @@ class Instruction21c(Instruction22x):
     return len(self)
 
   def get_ref_type(self):
-    return OPCODE_TABLE[self.op][2]
+    return REF_TYPE_TABLE[self.op]
  
   def get_item(self):
     return self.BBBB
@@ -415,6 +429,7 @@ class Instruction21c(Instruction22x):
   
 # AA|op CC|BB	23x	    op vAA, vBB, vCC
 class Instruction23x(Instruction):
+  __slots__ = ('AA', 'BB', 'CC')
   def as_byte_stream(self):
     pass
   
@@ -429,11 +444,11 @@ class Instruction23x(Instruction):
   def from_string(self):
     pass
 
-  def from_byte(self, stream):
-    temp1 = stream.read()
+  def from_insns(self, insns, index):
+    temp1 = insns[index]
     self.AA = temp1 >> 8 & 0xff
     self.op = temp1 & 0xff
-    temp2 = stream.read()
+    temp2 = insns[index + 1]
     self.CC = temp2 >> 8 & 0xff
     self.BB = temp2 & 0xff
         
@@ -442,11 +457,13 @@ class Instruction23x(Instruction):
 
 # AA|op CC|BB   22b     op vAA, vBB, #+CC
 class Instruction22b(Instruction23x):
+  __slots__ = ()
   def as_string(self):
     return '{} v{:02x}, v{:02x}, #+{:02x}'.format(self.get_opcode_string(), self.AA, self.BB, self.CC)
 
 # B|A|op CCCC	22t	    op vA, vB, +CCCC    
 class Instruction22t(Instruction):
+  __slots__ = ('A', 'B', 'CCCC')
   def as_byte_stream(self):
     pass
   
@@ -461,24 +478,26 @@ class Instruction22t(Instruction):
   def from_string(self):
     pass
 
-  def from_byte(self, stream):
-    temp = stream.read()
+  def from_insns(self, insns, index):
+    temp = insns[index]
     self.B = temp >> 12 & 0x0f
     self.A = temp >> 8 & 0x0f
     self.op = temp & 0xff
-    self.CCCC = stream.read()
+    self.CCCC = insns[index + 1]
     
   def __len__(self):
     return 4
 
 # B|A|op CCCC   22s     op vA, vB, #+CCCC
 class Instruction22s(Instruction22t):
+  __slots__ = ()
   def as_string(self):
     return '{} v{:01x}, v{:01x}, #+{:04x}'.format(self.get_opcode_string(), self.A, self.B, self.CCCC)
                                                  
 # B|A|op CCCC   22c     op vA, vB, type@CCCC
 #                                  field@CCCC                                                  
 class Instruction22c(Instruction22t):
+  __slots__ = ()
   def as_string(self):
     if self.op == 0x23 or self.op == 0x20:
       str = '{} v{:01x}, v{:01x}, '.format(self.get_opcode_string(), self.A, self.B) + self.CCCC
@@ -501,6 +520,7 @@ class Instruction22c(Instruction22t):
 # B|A|op CCCC   22cs    op vA, vB, fieldoff@CCCC
 # not used instruction
 class Instruction22cs(Instruction22t):
+  __slots__ = ()
   def as_string(self):
     str = '{} v{:01x}, v{:01x}, '.format(self.get_opcode_string(), self.A, self.B) + self.CCCC
     return str
@@ -509,7 +529,8 @@ class Instruction22cs(Instruction22t):
     self.BBBB = self.get_typeindex_item(self.op, self.BBBB)
 
 # ØØ|op AAAAlo AAAAhi	30t	    op +AAAAAAAA
-class Instruction30t(Instruction):
+class Instruction30t(GotoInstruction):
+  __slots__ = ()
   def as_byte_stream(self):
     pass
   
@@ -524,17 +545,16 @@ class Instruction30t(Instruction):
   def from_string(self):
     pass
 
-  def from_byte(self, stream):
-    self.op = stream.read() & 0xff
-    self.AAAAlo = stream.read()
-    self.AAAAhi = stream.read()
-    self.AAAAAAAA = self.AAAAhi << 16 + self.AAAAlo
+  def from_insns(self, insns, index):
+    self.op = insns[index] & 0xff
+    self.AAAAAAAA = insns[index + 2] << 16 | insns[index + 1]
                                                          
   def __len__(self):
     return 6
 
 # ØØ|op AAAA BBBB	32x	    op vAAAA, vBBBB
 class Instruction32x(Instruction):
+  __slots__ = ('AAAA', 'BBBB')
   def as_byte_stream(self):
     pass
   
@@ -550,16 +570,17 @@ class Instruction32x(Instruction):
   def from_string(self):
     pass
 
-  def from_byte(self, stream):
-    self.op = stream.read() & 0xff
-    self.AAAA = stream.read()
-    self.BBBB = stream.read()
+  def from_insns(self, insns, index):
+    self.op = insns[index] & 0xff
+    self.AAAA = insns[index + 1]
+    self.BBBB = insns[index + 2]
     
   def __len__(self):
     return 6
 
 # AA|op BBBBlo BBBBhi	31i	    op vAA, #+BBBBBBBB    
 class Instruction31i(Instruction):
+  __slots__ = ('AA', 'BBBBBBBB')
   def as_byte_stream(self):
     pass
   
@@ -574,19 +595,18 @@ class Instruction31i(Instruction):
   def from_string(self):
     pass
 
-  def from_byte(self, stream):
-    temp = stream.read()
+  def from_insns(self, insns, index):
+    temp = insns[index]
     self.AA = temp >> 8 & 0xff
     self.op = temp & 0xff
-    self.BBBBlo = stream.read()
-    self.BBBBhi = stream.read()
-    self.BBBBBBBB = self.BBBBhi << 16 | self.BBBBlo
+    self.BBBBBBBB = insns[index + 2] << 16 | insns[index + 1]
 
   def __len__(self):
     return 6
 
 # AA|op BBBBlo BBBBhi   31t	op vAA, +BBBBBBBB
 class Instruction31t(Instruction31i):
+  __slots__ = ()
   def as_string(self):
     return '{} v{:02x}, +{:08x}'.format(self.get_opcode_string(), self.AA, self.BBBBBBBB)
   
@@ -594,16 +614,6 @@ class Instruction31t(Instruction31i):
     return True
 
 
-  def from_byte(self, stream):
-    temp = stream.read()
-    self.AA = temp >> 8 & 0xff
-    self.op = temp & 0xff
-    self.BBBBlo = stream.read()
-    self.BBBBhi = stream.read()
-    self.BBBBBBBB = self.BBBBhi << 16 | self.BBBBlo
-    
-
-
   def write_byte_stream(self, stream, manager):
     self.write_op(stream, self.AA, self.op)
     stream.write_uint(self.BBBBBBBB)
@@ -613,6 +623,7 @@ class Instruction31t(Instruction31i):
 
 # AA|op BBBBlo BBBBhi   31c	op vAA, string@BBBBBBBB
 class Instruction31c(Instruction31i):
+  __slots__ = ()
   def as_string(self):
     #print('BBBBBBBB : {:08x}'.format(self.BBBBBBBB))
     str = '{} v{:02x}, '.format(self.get_opcode_string(), self.AA) + self.BBBBBBBB
@@ -639,6 +650,7 @@ class Instruction31c(Instruction31i):
 #                               [A=1] op {vC}, kind@BBBB
 #                               [A=0] op {}, kind@BBBB
 class Instruction35c(Instruction):
+  __slots__ = ('A', 'G', 'BBBB', 'C', 'D', 'E', 'F')
   def as_byte_stream(self):
     pass
   
@@ -682,13 +694,13 @@ class Instruction35c(Instruction):
   def from_string(self):
     pass
 
-  def from_byte(self, stream):
-    temp = stream.read()
+  def from_insns(self, insns, index):
+    temp = insns[index]
     self.A = temp >> 12 & 0x0f
     self.G = temp >> 8 & 0x0f
     self.op = temp & 0xff
-    self.BBBB = stream.read()
-    temp = stream.read()
+    self.BBBB = insns[index + 1]
+    temp = insns[index + 2]
     self.F = temp >> 12 & 0x0f
     self.E = temp >> 8 & 0x0f
     self.D = temp >> 4 & 0x0f
@@ -707,7 +719,7 @@ class Instruction35c(Instruction):
 #                                   [A=1] op {vC}, vtaboff@BBBB
 # NOT USED                                                         
 class Instruction35ms(Instruction35c):
-  pass
+  __slots__ = ()
 
 # A|G|op BBBB F|E|D|C      35mi     [A=5] op {vC, vD, vE, vF, vG}, inline@BBBB
 #                                   [A=4] op {vC, vD, vE, vF}, inline@BBBB
@@ -716,12 +728,13 @@ class Instruction35ms(Instruction35c):
 #                                   [A=1] op {vC}, inline@BBBB
 # NOT USED                                                         
 class Instruction35mi(Instruction35c):
-  pass
+  __slots__ = ()
 
 # AA|op BBBB CCCC	3rc	    op {vCCCC .. vNNNN}, meth@BBBB
 #                           op {vCCCC .. vNNNN}, call_site@BBBB
 #                           op {vCCCC .. vNNNN}, type@BBBB
 class Instruction3rc(Instruction):
+  __slots__ = ('AA', 'BBBB', 'CCCC')
   def as_byte_stream(self):
     pass
   @property
@@ -746,12 +759,12 @@ class Instruction3rc(Instruction):
   def from_string(self):
     pass
 
-  def from_byte(self, stream):
-    temp = stream.read()
+  def from_insns(self, insns, index):
+    temp = insns[index]
     self.AA = temp >> 8 & 0xff
     self.op = temp & 0xff
-    self.BBBB = stream.read()
-    self.CCCC = stream.read()
+    self.BBBB = insns[index + 1]
+    self.CCCC = insns[index + 2]
     
   def __len__(self):
     return 6
@@ -760,11 +773,11 @@ class Instruction3rc(Instruction):
 
 # AA|op BBBB CCCC	3rms    op {vCCCC .. vNNNN}, vtaboff@BBBB
 class Instruction3rms(Instruction3rc):
-  pass
+  __slots__ = ()
 
 # AA|op BBBB CCCC	3rmi    op {vCCCC .. vNNNN}, inline@BBBB  
 class instruction3rmi(Instruction3rc):
-  pass
+  __slots__ = ()
 
 # A|G|op BBBB F|E|D|C HHHH	    45cc	[A=5] op {vC, vD, vE, vF, vG}, meth@BBBB, proto@HHHH
 #                                       [A=4] op {vC, vD, vE, vF}, meth@BBBB, proto@HHHH
@@ -772,6 +785,7 @@ class instruction3rmi(Instruction3rc):
 #                                       [A=2] op {vC, vD}, meth@BBBB, proto@HHHH
 #                                       [A=1] op {vC}, meth@BBBB, proto@HHHH  
 class Instruction45cc(Instruction):
+  __slots__ = ('A', 'G', 'BBBB', 'C', 'D', 'E', 'F', 'HHHH')
   def as_byte_stream(self):
     pass
   
@@ -802,28 +816,28 @@ class Instruction45cc(Instruction):
   def from_string(self):
     pass
 
-  def from_byte(self, stream):
-    temp = stream.readbyte()
-    self.A = temp >> 4 & 0x0f
-    self.G = temp & 0x0f
-    self.op = stream.readbyte()
-    self.BBBB = stream.readbyte() << 8 + stream.readbyte()
-    temp = stream.readbyte()
-    self.F = temp >> 4 & 0x0f
-    self.E = temp & 0x0f
-    temp = stream.readbyte()
+  def from_insns(self, insns, index):
+    temp = insns[index]
+    self.A = temp >> 12 & 0x0f
+    self.G = temp >> 8 & 0x0f
+    self.op = temp & 0xff
+    self.BBBB = insns[index + 1]
+    temp = insns[index + 2]
+    self.F = temp >> 12 & 0x0f
+    self.E = temp >> 8 & 0x0f
     self.D = temp >> 4 & 0x0f
     self.C = temp & 0x0f
-    self.HHHH = stream.readbyte() << 8 + stream.readbyte()
+    self.HHHH = insns[index + 3]
     
   def __len__(self):
     return 8
  
   def get_item(self):
-    return [self.BBBB, self,HHHH]
+    return [self.BBBB, self.HHHH]
 
 # AA|op BBBB CCCC HHHH	4rcc	op> {vCCCC .. vNNNN}, meth@BBBB, proto@HHHH   
 class Instruction4rcc(Instruction):
+  __slots__ = ('AA', 'BBBB', 'CCCC', 'HHHH')
   def as_byte_stream(self):
     pass
   
@@ -845,12 +859,13 @@ class Instruction4rcc(Instruction):
   def from_string(self):
     pass
 
-  def from_byte(self, stream):
-    self.AA = stream.readbyte()
-    self.op = stream.readbyte()
-    self.BBBB = stream.readbyte() << 8 + stream.readbyte()
-    self.CCCC = stream.readbyte() << 8 + stream.readbyte()
-    self.HHHH = stream.readbyte() << 8 + stream.readbyte()
+  def from_insns(self, insns, index):
+    temp = insns[index]
+    self.AA = temp >> 8 & 0xff
+    self.op = temp & 0xff
+    self.BBBB = insns[index + 1]
+    self.CCCC = insns[index + 2]
+    self.HHHH = insns[index + 3]
     
   def __len__(self):
     return 8
@@ -861,6 +876,7 @@ class Instruction4rcc(Instruction):
 
 # AA|op BBBBlo BBBB BBBB BBBBhi	51l	op vAA, #+BBBBBBBBBBBBBBBB
 class Instruction51l(Instruction):
+  __slots__ = ('AA', 'BBBBBBBBBBBBBBBB')
   def as_byte_stream(self):
     pass
 
@@ -875,11 +891,13 @@ class Instruction51l(Instruction):
   def from_string(self):
     pass
 
-  def from_byte(self, stream):
-    x = stream.read()
+  def from_insns(self, insns, index):
+    x = insns[index]
     self.AA = x >> 8 & 0xff
     self.op = x & 0xff
-    self.BBBBBBBBBBBBBBBB = stream.read() << 48 | stream.read() << 32 | stream.read() << 16 | stream.read()
+    # BBBBlo comes first
+    self.BBBBBBBBBBBBBBBB = (insns[index + 4] << 48 | insns[index + 3] << 32
+      | insns[index + 2] << 16 | insns[index + 1])
   def __len__(self):
     return 10
 
@@ -1309,3 +1327,135 @@ OPCODE_TABLE = [
     #unused
     
     # for odex
+
+
+def get_decode_table():
+  """
+    (format class, code unit count) for each opcode.
+    nop can be payload, so its count is 0(read from decoded opcode).
+  """
+  table = []
+  for op, row in enumerate(OPCODE_TABLE):
+    cls = row[0]
+    if op == 0:
+      width = 0
+    elif issubclass(cls, Instruction10x):
+      width = 1
+    else:
+      width = len(cls(None)) >> 1
+    table.append((cls, width))
+  return table
+
+DECODE_TABLE = get_decode_table()
+
+def get_ref_operand_table():
+  """
+    (code unit index, code unit count) of index operand for each opcode.
+    () for no index operand, None if the index is not a string, type, field or method.
+  """
+  table = []
+  for row in OPCODE_TABLE:
+    cls = row[0]
+    if issubclass(cls, Instruction31c):
+      operand = (1, 2)
+    elif issubclass(cls, (Instruction20bc, Instruction21c, Instruction22c, Instruction35c, Instruction3rc)):
+      operand = (1, 1)
+    elif issubclass(cls, (Instruction45cc, Instruction4rcc)):
+      operand = None
+    else:
+      operand = ()
+    if operand and row[2] not in (INSTRUCT_TYPE_STRING, INSTRUCT_TYPE_TYPE, INSTRUCT_TYPE_FIELD, INSTRUCT_TYPE_METHOD):
+      operand = None
+    table.append(operand)
+  return table
+
+REF_OPERAND_TABLE = get_ref_operand_table()
+
+# invoke flags
+INVOKE = 1
+INVOKE_STATIC = 2
+INVOKE_RANGE = 4
+INVOKE_POLYMORPHIC = 8
+
+OP_INVOKE_STATIC = 0x71
+OP_INVOKE_STATIC_RANGE = 0x77
+OP_INVOKE_POLYMORPHIC = 0xfa
+OP_INVOKE_POLYMORPHIC_RANGE = 0xfb
+
+def get_invoke_flags(op):
+  if 0x6e <= op <= 0x72:
+    flags = INVOKE
+  elif 0x74 <= op <= 0x78:
+    flags = INVOKE | INVOKE_RANGE
+  elif 0xfa <= op <= 0xfd:
+    # invoke-polymorphic, invoke-custom and their range forms
+    flags = INVOKE if op % 2 == 0 else INVOKE | INVOKE_RANGE
+  else:
+    return 0
+  if op in (OP_INVOKE_STATIC, OP_INVOKE_STATIC_RANGE):
+    flags |= INVOKE_STATIC
+  if op in (OP_INVOKE_POLYMORPHIC, OP_INVOKE_POLYMORPHIC_RANGE):
+    flags |= INVOKE_POLYMORPHIC
+  return flags
+
+def get_opcode_info():
+  """
+    (format class, name, code unit count, ref type, section, ref operand, invoke flags)
+    for each opcode, from OPCODE_TABLE, DECODE_TABLE and REF_OPERAND_TABLE.
+    ref type is -1 and section is None for opcode without index operand.
+  """
+  table = []
+  for op, row in enumerate(OPCODE_TABLE):
+    ref_type = row[2] if len(row) > 2 else -1
+    section = row[3] if len(row) > 3 else None
+    table.append((row[0], row[1], DECODE_TABLE[op][1], ref_type, section, REF_OPERAND_TABLE[op], get_invoke_flags(op)))
+  return table
+
+OPCODE_INFO = get_opcode_info()
+
+# columns of OPCODE_INFO, indexed by opcode in hot paths
+WIDTH_TABLE = [x[2] for x in OPCODE_INFO]
+REF_TYPE_TABLE = [x[3] for x in OPCODE_INFO]
+SECTION_TABLE = [x[4] for x in OPCODE_INFO]
+INVOKE_TABLE = [x[6] for x in OPCODE_INFO]
+
+def get_type_item(manager, index):
+  ret = manager.get_type(index)
+  if len(ret) > 1: return ret
+  if ret == 'v':
+    return 'void'
+  if ret == 'i':
+    return 'int'
+  return ret
+
+# item of index for each ref type
+ITEM_RESOLVERS = [None] * (INSTRUCT_TYPE_CALL_PROTO + 1)
+ITEM_RESOLVERS[INSTRUCT_TYPE_STRING] = lambda manager, index: manager.get_string_by_index(index)
+ITEM_RESOLVERS[INSTRUCT_TYPE_TYPE] = get_type_item
+ITEM_RESOLVERS[INSTRUCT_TYPE_METHOD] = lambda manager, index: manager.get_method_dex_item_by_index(index)
+ITEM_RESOLVERS[INSTRUCT_TYPE_FIELD] = lambda manager, index: manager.get_field_dex_item_by_index(index)
+ITEM_RESOLVERS[INSTRUCT_TYPE_OFFSET] = lambda manager, index: manager.get_offset_by_index(index)
+ITEM_RESOLVERS[INSTRUCT_TYPE_KIND] = lambda manager, index: manager.get_kind_by_index(index)
+ITEM_RESOLVERS[INSTRUCT_TYPE_PROTO] = lambda manager, index: manager.get_proto_dex_item_by_index(index)
+ITEM_RESOLVERS[INSTRUCT_TYPE_CALL_SITE] = lambda manager, index: manager.get_site_item_by_index(index)
+ITEM_RESOLVERS[INSTRUCT_TYPE_METHOD_HANDLE] = lambda manager, index: manager.get_method_handle_item_by_index(index)
+
+def decode_insns(manager, insns, start=0, end=None):
+  """
+    decode code units(array('H') or memoryview) to opcode list
+  """
+  if end is None:
+    end = len(insns)
+  table = DECODE_TABLE
+  ret = []
+  append = ret.append
+  index = start
+  while index < end:
+    cls, width = table[insns[index] & 0xff]
+    opcode = cls(manager)
+    opcode.from_insns(insns, index)
+    if width == 0:
+      width = len(opcode) >> 1
+    append(opcode)
+    index += width
+  return ret
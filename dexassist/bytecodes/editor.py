@@ -1,17 +1,122 @@
+from bisect import bisect_right
 import dexassist.bytecodes.base as base
 import dexassist.dex.dex as dex
+from dexassist.bytecodes.label import Label
 
 
+# branch format -> (field of relative target, bit width)
+BRANCH_FIELDS = {
+  base.Instruction10t: ('AA', 8),
+  base.Instruction20t: ('AAAA', 16),
+  base.Instruction30t: ('AAAAAAAA', 32),
+  base.Instruction21t: ('BBBB', 16),
+  base.Instruction22t: ('CCCC', 16),
+  base.Instruction31t: ('BBBBBBBB', 32)
+}
+OP_PACKED_SWITCH = 0x2b
+OP_SPARSE_SWITCH = 0x2c
+OP_GOTO = 0x28
+OP_GOTO_16 = 0x29
+OP_GOTO_32 = 0x2a
+GOTO_FORMS = {
+  OP_GOTO: base.Instruction10t,
+  OP_GOTO_16: base.Instruction20t,
+  OP_GOTO_32: base.Instruction30t
+}
+
+def get_goto_op(distance):
+  """
+    shortest goto for distance(code units), only goto/32 can branch to itself
+  """
+  if distance == 0:
+    return OP_GOTO_32
+  if -0x80 <= distance < 0x80:
+    return OP_GOTO
+  if -0x8000 <= distance < 0x8000:
+    return OP_GOTO_16
+  return OP_GOTO_32
+
+def set_goto_form(opcode, op):
+  """
+    goto keeps its identity(labels refer to it), only format is changed
+  """
+  opcode.__class__ = GOTO_FORMS[op]
+  opcode.op = op
+
+def to_signed(value, bits):
+  if value >= 1 << (bits - 1):
+    return value - (1 << bits)
+  return value
+
+def to_unsigned(value, bits):
+  if value < -(1 << (bits - 1)) or value >= 1 << (bits - 1):
+    raise Exception('branch offset {} does not fit in {} bits'.format(value, bits))
+  return value & ((1 << bits) - 1)
+
+def is_payload(opcode):
+  return type(opcode) is base.Instruction10x and opcode.op == 0 and opcode.high != 0
+
+def is_nop(opcode):
+  return type(opcode) is base.Instruction10x and opcode.op == 0 and opcode.high == 0
+
+# slots which are not operands, labels are compared by target
+STATE_SKIP = ('manager', 'unique_key', 'label', 'switch', 'labels')
+state_fields = {}
+
+def get_state_fields(cls):
+  fields = state_fields.get(cls)
+  if fields is None:
+    fields = []
+    for c in cls.__mro__:
+      for name in getattr(c, '__slots__', ()):
+        if name not in STATE_SKIP and name not in fields:
+          fields.append(name)
+    fields = state_fields[cls] = tuple(fields)
+  return fields
+
+def get_value_state(value):
+  # containers are copied, in place changes of payload data are seen
+  if isinstance(value, (list, bytearray)):
+    return tuple(value)
+  return value
+
+def get_label_state(label):
+  if label is None:
+    return None
+  return (label, label.target)
+
+def get_opcode_state(opcode):
+  state = [opcode, type(opcode), get_label_state(getattr(opcode, 'label', None))]
+  labels = getattr(opcode, 'labels', None)
+  if labels is not None:
+    state.append(tuple(get_label_state(x) for x in labels))
+  for name in get_state_fields(type(opcode)):
+    state.append(get_value_state(getattr(opcode, name, None)))
+  return tuple(state)
+
+def get_try_state(t):
+  handlers = tuple((h, h.exception_type, h.addr, get_label_state(getattr(h, 'label', None)))
+    for h in t.catch_handlers)
+  return (t, t.start, t.end, get_value_state(t.catch_all_handlers), handlers,
+    get_label_state(getattr(t, 'start_label', None)),
+    get_label_state(getattr(t, 'end_label', None)))
+
 """
 this class can modify dex opcodes.
 ```
 editor = method.get_editor()
 for opcode in editor.opcodes:
   if opcode.op == CONST_STRING:
-    opcode.string = opcode.string + ' update'
+    opcode.BBBB = opcode.BBBB + ' update'
   if opcode.op == INVOKE_DYNAMIC:
-    opcode.method = new_method
+    opcode.BBBB = new_method
+  if opcode.op == INVOKE_STATIC and opcode.ref.name == 'log':
+    editor.remove(opcode)
+editor.insert_before(opcode, [new_opcode])
+editor.commit()
 ```
+edits are pending until commit(), branch targets, try ranges and
+switch payloads are recalculated once for all of them.
 """
 class Editor(object):
   def find_label(self, name):
@@ -19,15 +124,38 @@ class Editor(object):
       if x.name == name: return x
     return None
 
+  def get_anchor(self, opcode):
+    if self.find_opcode(opcode) == -1:
+      # opcode may be added by pending edits
+      self.commit()
+      if self.find_opcode(opcode) == -1:
+        raise Exception('opcode is not in editor : {}'.format(opcode))
+    return id(opcode)
+
+  def insert_before(self, opcode, new_opcodes):
+    """
+      branches to opcode will reach new_opcodes first
+    """
+    if not isinstance(new_opcodes, (list, tuple)): new_opcodes = [new_opcodes]
+    self._before.setdefault(self.get_anchor(opcode), []).extend(new_opcodes)
+
+  def insert_after(self, opcode, new_opcodes):
+    if not isinstance(new_opcodes, (list, tuple)): new_opcodes = [new_opcodes]
+    after = self._after.setdefault(self.get_anchor(opcode), [])
+    after[0:0] = new_opcodes
+
+  def replace(self, opcode, new_opcodes):
+    """
+      branches to opcode go to first of new_opcodes,
+      or to the next opcode if new_opcodes is empty.
+      switch or array data payload can not be removed or replaced
+      while its opcode is kept, commit() raises
+    """
+    if not isinstance(new_opcodes, (list, tuple)): new_opcodes = [new_opcodes]
+    self._replaced[self.get_anchor(opcode)] = list(new_opcodes)
+
   def remove(self, opcode):
-    index = self.opcode_list.index(opcode)
-    if index != -1:
-      self.opcode_list.remove(opcode)
-      nop = base.Instruction10x(dex.DexManager())
-      nop.op = 0
-      nop.high = 0
-      for i in range(opcode.get_code_unit_count()):
-        self.opcode_list.insert(index + i, nop)
+    self.replace(opcode, [])
 
       
   @property
@@ -41,7 +169,11 @@ class Editor(object):
       initialize editor instance
     """
 
+    self.manager = None
     self.tries = []
+    self._before = {}
+    self._after = {}
+    self._replaced = {}
     self.opcode_list = []
     self.labels = []
     self.__unique_key = 0
@@ -49,13 +181,246 @@ class Editor(object):
       x.unique_key = self.unique_key
 
 
+  def has_pending(self):
+    return bool(self._before or self._after or self._replaced)
+
+  def get_state(self):
+    """
+      snapshot of opcodes, operands, labels and tries.
+      compare snapshots to find opcodes changed in place
+    """
+    return ([get_opcode_state(x) for x in self._opcode_list],
+      [get_try_state(t) for t in self.tries])
+
+  def register_label(self, label):
+    self.labels.append(label)
+
+  def get_label(self, opcode):
+    """
+      label to opcode, for branch target of new opcode
+      ```
+      goto = base.Instruction10t(manager)
+      goto.op = 0x28
+      goto.label = editor.get_label(target_opcode)
+      ```
+    """
+    return Label(self, opcode)
+
+  def bind_labels(self):
+    """
+      replace raw branch offsets with labels bound to target opcodes.
+      branch opcode has label, switch payload has labels and switch,
+      try has start_label and end_label(exclusive), handler has label.
+    """
+    self.build_index()
+    targets = self.resolve_targets()
+    labels = {}
+    def get_label(x):
+      if id(x) not in labels:
+        labels[id(x)] = Label(self, x)
+      return labels[id(x)]
+    for x in self._opcode_list:
+      target = targets['branch'].get(id(x))
+      if target is None: continue
+      x.label = get_label(target)
+      if id(x) in targets['switch']:
+        target.switch = x
+        target.labels = [get_label(t) for t in targets['switch'][id(x)]]
+    for t, start, end, handlers in targets['tries']:
+      t.start_label = get_label(start)
+      t.end_label = get_label(end)
+      for h, target in zip(t.catch_handlers, handlers):
+        h.label = get_label(target)
+
   def commit(self):
     """
       commit all changed.
       changes will not affected after commit() calls.
       call in dexwriter
     """
-    pass
+    if not self.has_pending():
+      return
+    old_list = self._opcode_list
+
+    # opcodes of each old opcode slot
+    slots = []
+    for x in old_list:
+      key = id(x)
+      slot = list(self._before.get(key, ()))
+      slot.extend(self._replaced.get(key, [x]))
+      slot.extend(self._after.get(key, ()))
+      slots.append(slot)
+    new_list = []
+    for slot in slots:
+      new_list.extend(slot)
+
+    # payload is not forwarded, it can not be removed while referenced
+    kept = set(id(x) for x in new_list)
+    for x in new_list:
+      label = getattr(x, 'label', None)
+      if label is not None and is_payload(label.target) and id(label.target) not in kept:
+        raise Exception('payload of {} is removed'.format(x))
+    self._before = {}
+    self._after = {}
+    self._replaced = {}
+
+    # old opcode -> first opcode of its slot or following slot
+    slot_start = {}
+    next_start = None
+    for x, slot in zip(reversed(old_list), reversed(slots)):
+      if slot:
+        next_start = slot[0]
+      slot_start[id(x)] = next_start
+
+    for label in self.labels:
+      if label.target is None or is_payload(label.target): continue
+      if id(label.target) in slot_start:
+        label.target = slot_start[id(label.target)]
+
+    self.opcode_list = new_list
+    self.layout()
+
+  def layout(self):
+    """
+      write offsets of labels to branches, switch payloads and tries.
+      goto takes the shortest form which fits and
+      payloads are aligned to 4 bytes with nop.
+    """
+    self.commit()
+    gotos = []
+    for x in self._opcode_list:
+      if x.op in GOTO_FORMS and getattr(x, 'label', None) is not None:
+        set_goto_form(x, OP_GOTO)
+        gotos.append(x)
+
+    changed = True
+    while changed:
+      changed = self.align_payloads()
+      offsets, indexes = self.get_index()
+      for x in gotos:
+        distance = self.get_label_offset(x.label) - offsets[indexes[id(x)]]
+        op = get_goto_op(distance // 2)
+        if op > x.op:
+          set_goto_form(x, op)
+          changed = True
+      if changed:
+        self.build_index()
+
+    offsets, indexes = self.get_index()
+    for x in self._opcode_list:
+      label = getattr(x, 'label', None)
+      if label is None: continue
+      field = BRANCH_FIELDS.get(type(x))
+      if field is None: continue
+      name, bits = field
+      offset = offsets[indexes[id(x)]]
+      target_offset = self.get_label_offset(label)
+      if target_offset == offsets[-1]:
+        raise Exception('branch target of {} is removed'.format(x))
+      setattr(x, name, to_unsigned((target_offset - offset) // 2, bits))
+      if getattr(label.target, 'switch', None) is x:
+        label.target.targets = [to_unsigned((self.get_label_offset(t) - offset) // 2, 32) for t in label.target.labels]
+
+    tries = []
+    for t in self.tries:
+      if getattr(t, 'start_label', None) is None:
+        tries.append(t)
+        continue
+      start = self.get_label_offset(t.start_label) // 2
+      end = self.get_label_offset(t.end_label) // 2 - 1
+      if end < start: continue
+      t.start = start
+      t.end = end
+      for h in t.catch_handlers:
+        h.addr = self.get_label_offset(h.label) // 2
+        if h.exception_type is None:
+          t.catch_all_handlers = h.addr
+      tries.append(t)
+    self.tries[:] = tries
+
+  def align_payloads(self):
+    """
+      returns True if nop is added or removed
+    """
+    targets = set([id(x.target) for x in self.labels])
+    new_list = []
+    offset = 0
+    changed = False
+    for x in self._opcode_list:
+      if is_payload(x) and offset % 4:
+        if new_list and is_nop(new_list[-1]) and id(new_list[-1]) not in targets:
+          offset -= len(new_list.pop())
+        else:
+          nop = base.Instruction10x(self.manager)
+          nop.op = 0
+          nop.high = 0
+          new_list.append(nop)
+          offset += len(nop)
+        changed = True
+      new_list.append(x)
+      offset += len(x)
+    if changed:
+      self.opcode_list = new_list
+    return changed
+
+  def get_label_offset(self, label):
+    """
+      None target is end of code
+    """
+    offsets, indexes = self.get_index()
+    if label.target is None:
+      return offsets[-1]
+    return offsets[indexes[id(label.target)]]
+
+  def resolve_targets(self):
+    """
+      find target opcodes of raw branch offsets, switch payloads and tries
+      on current offsets.
+    """
+    branch = {}
+    switch = {}
+    for x in self._opcode_list:
+      field = BRANCH_FIELDS.get(type(x))
+      if field is None: continue
+      name, bits = field
+      offset = self.get_offset_by_id(x)
+      target = self.get_target(offset + to_signed(getattr(x, name), bits) * 2)
+      branch[id(x)] = target
+      if x.op == OP_PACKED_SWITCH or x.op == OP_SPARSE_SWITCH:
+        switch[id(x)] = [self.get_target(offset + to_signed(t, 32) * 2) for t in target.targets]
+    tries = []
+    for t in self.tries:
+      start = self.get_target(t.start * 2)
+      # opcode after the range, None for end of code
+      last = self.get_opcode_by_offset_(t.end * 2)
+      if last is None:
+        raise Exception('no opcode at offset {}'.format(t.end * 2))
+      end = self.find_opcode(last) + 1
+      end = self._opcode_list[end] if end < len(self._opcode_list) else None
+      handlers = [self.get_target(h.addr * 2) for h in t.catch_handlers]
+      tries.append((t, start, end, handlers))
+    return {
+      'branch': branch,
+      'switch': switch,
+      'tries': tries
+    }
+
+  def get_offset_by_id(self, opcode):
+    return self._offsets[self._indexes[id(opcode)]]
+
+  def get_target(self, offset):
+    ret = self.get_opcode_by_offset_(offset)
+    if ret is None or self.get_offset_by_id(ret) != offset:
+      raise Exception('no opcode at offset {}'.format(offset))
+    return ret
+
+  def __getstate__(self):
+    # pending edits and index are keyed by id()
+    self.commit()
+    state = dict(self.__dict__)
+    state['_offsets'] = None
+    state['_indexes'] = None
+    return state
 
   def save(self):
     """
@@ -68,6 +433,75 @@ class Editor(object):
     self.commit()
 
 
+  @property
+  def opcode_list(self):
+    self.commit()
+    return self._opcode_list
+
+  @opcode_list.setter
+  def opcode_list(self, value):
+    self._opcode_list = value
+    self.invalidate()
+
+  def invalidate(self):
+    """
+      drop offset index, call after changing opcode_list directly
+    """
+    self._offsets = None
+    self._indexes = None
+    # method is written again by incremental save
+    self.modified = True
+
+  def build_index(self):
+    """
+      offsets[i] is offset of opcode_list[i], offsets[-1] is code size.
+      indexes maps id(opcode) -> position.
+    """
+    offsets = []
+    indexes = {}
+    offset = 0
+    for i, x in enumerate(self._opcode_list):
+      offsets.append(offset)
+      indexes[id(x)] = i
+      offset += len(x)
+    offsets.append(offset)
+    self._offsets = offsets
+    self._indexes = indexes
+
+  def get_index(self):
+    if self._offsets is None or len(self._offsets) != len(self._opcode_list) + 1:
+      self.build_index()
+    return self._offsets, self._indexes
+
+  def find_opcode(self, opcode):
+    offsets, indexes = self.get_index()
+    index = indexes.get(id(opcode), -1)
+    if index != -1 and self._opcode_list[index] is not opcode:
+      # opcode_list was changed in place
+      self.build_index()
+      index = self._indexes.get(id(opcode), -1)
+    return index
+
+  def get_opcode_index(self, opcode):
+    """
+      return position of opcode in opcode_list, -1 if not exist
+    """
+    self.commit()
+    return self.find_opcode(opcode)
+
+  def get_opcode_by_offset_(self, offset):
+    offsets, indexes = self.get_index()
+    if offset < 0 or offset >= offsets[-1]:
+      return None
+    return self._opcode_list[bisect_right(offsets, offset) - 1]
+
+  def get_opcode_by_offset(self, offset):
+    """
+      return opcode which covers offset, None if out of code
+    """
+    self.commit()
+    return self.get_opcode_by_offset_(offset)
+
   @property
   def opcodes(self):
     """
@@ -75,6 +509,12 @@ class Editor(object):
     """
     return self.opcode_list
 
+  def get_code_size(self):
+    """
+      size of opcodes in bytes, pending edits are not committed or counted
+    """
+    return sum(len(x) for x in self._opcode_list)
+
   def is_in_try(self, opcode):
     offset = self.get_opcode_offset(opcode)
     for t in self.tries:
@@ -86,12 +526,10 @@ class Editor(object):
       return current opcode offset
       return -1 if opcode does not exist in opcodes
     """
-    i = 0
-    for x in self.opcodes:
-      if x.unique_key == opcode.unique_key:
-        return i
-      i += len(x)
-    return -1
+    index = self.get_opcode_index(opcode)
+    if index == -1:
+      return -1
+    return self._offsets[index]
 
 
 """
@@ -112,9 +550,14 @@ class TryCatch(object):
     else:
       offset = self.editor.get_opcode_offset(opcode)
 
-    start_offset = self.editor.get_opcode_offset(self.start)
-    end_offset = self.editor.get_opcode_offset(self.end)
-    return offset >= start_offset and offset <= end_offset
+    if getattr(self, 'start_label', None) is None:
+      # labels are not bound, start and end are code units, end is inclusive
+      start_offset = self.start * 2
+      end_offset = (self.end + 1) * 2
+    else:
+      start_offset = self.start_label.get_offset()
+      end_offset = self.end_label.get_offset()
+    return offset >= start_offset and offset < end_offset
 
   def get_exception_handlers(self):
     return self.catch_handlers
@@ -139,22 +582,6 @@ class VopCode(object):
     self.op = op
 
 
-"""
-target offset class
-if opcode has target branch offset, target branch offset will be replaced with label class.
-"""
-class Label(object):
-  def __init__(self, editor, op, name=None):
-    self.op = op
-    op.labeled = True
-    self.editor = editor
-    self.name = name
-    self.editor.register_label(self)
-  
-  def get_offset(self):
-    return self.editor.get_opcode_offset(self.op)
-
-
 """
 ```
 label = editor.get_label_by_name("test_label")
@@ -1,8 +1,21 @@
-
+"""
+target offset class
+branch target, switch payload target and try range are bound to opcode by label.
+offset is calculated when needed, so it follows opcode edits.
+"""
 class Label(object):
-  def __init__(self, editor, target_opcode):
+  def __init__(self, editor, target_opcode, name=None):
     self.target = target_opcode
     self.editor = editor
+    self.name = name
+    self.editor.register_label(self)
+
+  @property
+  def op(self):
+    return self.target
 
   def get_offset(self):
-      return self.editor.get_offset(self.target)
+    """
+      offset in bytes, None target is end of code
+    """
+    return self.editor.get_label_offset(self)
@@ -0,0 +1,97 @@
+"""
+on-disk parse cache
+
+converted dex(normalize.Dex with its DexManager tables) is pickled and
+zlib compressed into one file per dex, keyed by header signature and checksum.
+files are evicted by least recent use(mtime) when the directory exceeds max_size.
+
+```
+cache = ParseCache('/tmp/dexcache')
+d = dex.from_file(path, DexConverter(), cache=cache)
+```
+"""
+import os
+import pickle
+import struct
+import zlib
+
+CACHE_VERSION = 6
+CACHE_SUFFIX = '.dexcache'
+
+class ParseCache(object):
+  def __init__(self, directory, max_size=512 * 1024 * 1024):
+    self.directory = directory
+    self.max_size = max_size
+    os.makedirs(directory, exist_ok=True)
+
+  @staticmethod
+  def get_key(buf):
+    """
+      signature and checksum from dex header
+    """
+    checksum = struct.unpack_from('<I', buf, 8)[0]
+    signature = bytes(buf[12:32])
+    return '{}_{:08x}_v{}'.format(signature.hex(), checksum, CACHE_VERSION)
+
+  def get_path(self, key):
+    return os.path.join(self.directory, key + CACHE_SUFFIX)
+
+  def load(self, key):
+    """
+      returns cached dex or None
+    """
+    path = self.get_path(key)
+    try:
+      with open(path, 'rb') as f:
+        data = f.read()
+    except OSError:
+      return None
+    try:
+      ret = pickle.loads(zlib.decompress(data))
+    except Exception:
+      # broken or incompatible entry
+      self.remove(path)
+      return None
+    # touch for lru
+    os.utime(path)
+    return ret
+
+  def store(self, key, value):
+    path = self.get_path(key)
+    data = zlib.compress(pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL))
+    tmp_path = '{}.{}.tmp'.format(path, os.getpid())
+    with open(tmp_path, 'wb') as f:
+      f.write(data)
+    os.replace(tmp_path, path)
+    self.evict()
+
+  def remove(self, path):
+    try:
+      os.remove(path)
+    except OSError:
+      pass
+
+  def evict(self):
+    entries = []
+    total = 0
+    for name in os.listdir(self.directory):
+      if not name.endswith(CACHE_SUFFIX):
+        continue
+      path = os.path.join(self.directory, name)
+      try:
+        st = os.stat(path)
+      except OSError:
+        continue
+      entries.append((st.st_mtime, st.st_size, path))
+      total += st.st_size
+    entries.sort()
+    for mtime, size, path in entries:
+      if total <= self.max_size:
+        break
+      self.remove(path)
+      total -= size
+
+  def clear(self):
+    for name in os.listdir(self.directory):
+      if name.endswith(CACHE_SUFFIX):
+        self.remove(os.path.join(self.directory, name))
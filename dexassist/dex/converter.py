@@ -8,15 +8,29 @@ from dexassist.bytecodes import base
 class DexConverter(object):
   def get_dex(self, header, manager):
     self.dex = normalize.Dex(manager)
+    manager.pool = self.dex.pool
     for x in manager.class_def_list:
       self.dex.add_class(self.create_dex_class(x, manager))
-    for clazz in self.dex.classes:
-      for method in clazz.methods:
-        if method.editor is None: continue
-        for opcode in method.editor.opcode_list:
-          opcode.set_ref_item()
-
     return self.dex
+
+  def get_class(self, header, manager, class_type):
+    """
+      convert only one class, for lazy parsed dex.
+      ```
+      header = dex.from_file(path, None, lazy=True)
+      clazz = DexConverter().get_class(header, header.manager, 'Lcom/example/Main;')
+      ```
+    """
+    if getattr(self, 'dex', None) is None:
+      self.dex = normalize.Dex(manager)
+      manager.pool = self.dex.pool
+    cdi = manager.get_class_def_by_type(class_type)
+    if cdi is None:
+      return None
+    clazz = self.create_dex_class(cdi, manager)
+    self.dex.add_class(clazz)
+    return clazz
+
   def translate_encoded_value(self, parent, manager, encoded_value):
 
     return translate_encoded_value(self.dex, parent, manager, encoded_value)
@@ -93,47 +107,36 @@ class DexConverter(object):
     for f in cdi.data.static_fields:
       field_idx += f.field_idx_diff
       access_flags = f.access_flags
-      field = manager.field_list[field_idx]
-      field_name = manager.string_list[field.name_idx]
-      type_name = manager.type_list[field.type_idx]
+      field_name = manager.get_field_name(field_idx)
+      type_name = manager.get_field_type(field_idx)
       f = self.create_dex_field(item, field_name, type_name, access_flags)
       f.annotations = field_annotation_table.get(field_idx, [])
       item.fields.append(f)
       manager.field_item_list[field_name + item.name] = f
+      manager.field_refs[field_idx] = f
       
     field_idx = 0
     for f in cdi.data.instance_fields:
       field_idx += f.field_idx_diff
       access_flags = f.access_flags
-      field = manager.field_list[field_idx]
-      field_name = manager.string_list[field.name_idx]
-      type_name = manager.type_list[field.type_idx]
+      field_name = manager.get_field_name(field_idx)
+      type_name = manager.get_field_type(field_idx)
       f = self.create_dex_field(item, field_name, type_name, access_flags)
       f.annotations = field_annotation_table.get(field_idx, [])
       item.fields.append(f)
       manager.field_item_list[field_name + item.name] = f
+      manager.field_refs[field_idx] = f
 
     method_idx = 0
     for m in cdi.data.direct_methods:
       method_idx += m.method_idx_diff
-      method_item = manager.method_list[method_idx]
-      class_idx = method_item.class_idx
-      proto_idx = method_item.proto_idx
-      name_idx = method_item.name_idx
-
-      method_name = manager.string_list[name_idx]
+      proto_idx = manager.get_method_proto_index(method_idx)
+      method_name = manager.get_method_name(method_idx)
       access_flags = m.access_flags
       code = m.code
-      proto = manager.proto_list[proto_idx]
-      proto_shorty = manager.string_list[proto.shorty_idx]
-      return_type_idx = proto.return_type_idx
-      parameter = []
-      return_type = manager.type_list[return_type_idx]
-      if proto.type_list:
-        for type_item in proto.type_list.list:
-          parameter_type_idx = type_item.type_idx
-          type_info = manager.type_list[parameter_type_idx]
-          parameter.append(type_info)
+      proto_shorty = manager.get_proto_shorty(proto_idx)
+      return_type = manager.get_proto_return_type(proto_idx)
+      parameter = manager.get_proto_parameters(proto_idx)
       x = self.create_dex_method(manager, item, method_name, access_flags, proto_shorty, parameter, return_type, code)
       x.annotations = method_annotation_table.get(method_idx, [])
       x.param_annotations = param_annotation_table.get(method_idx, [])
@@ -141,31 +144,19 @@ class DexConverter(object):
         x.register_count = m.code.registers_size
       item.methods.append(x)
       manager.method_item_list[item.type + method_name + ','.join([str(z) for z in x.parameters])] = x
+      manager.method_refs[method_idx] = x
       manager.proto_item_list[return_type + "".join(parameter)] = x.create_proto()
     
     method_idx = 0
     for m in cdi.data.virtual_methods:
       method_idx += m.method_idx_diff
-      method_item = manager.method_list[method_idx]
-      class_idx = method_item.class_idx
-      proto_idx = method_item.proto_idx
-      name_idx = method_item.name_idx
-
-      method_name = manager.string_list[name_idx]
+      proto_idx = manager.get_method_proto_index(method_idx)
+      method_name = manager.get_method_name(method_idx)
       access_flags = m.access_flags
       code = m.code
-      
-      proto = manager.proto_list[proto_idx]
-      proto_shorty = manager.string_list[proto.shorty_idx]
-      dict_key = manager.string_list[proto.shorty_idx]
-      return_type_idx = proto.return_type_idx
-      parameter = []
-      return_type = manager.type_list[return_type_idx]
-      if proto.type_list:
-        for type_item in proto.type_list.list:
-          parameter_type_idx = type_item.type_idx
-          type_info = manager.type_list[parameter_type_idx]
-          parameter.append(type_info)
+      proto_shorty = manager.get_proto_shorty(proto_idx)
+      return_type = manager.get_proto_return_type(proto_idx)
+      parameter = manager.get_proto_parameters(proto_idx)
       x = self.create_dex_method(manager, item, method_name, access_flags, proto_shorty, parameter, return_type, code)
       x.annotations = method_annotation_table.get(method_idx, [])
       x.param_annotations = param_annotation_table.get(method_idx, [])
@@ -173,6 +164,7 @@ class DexConverter(object):
         x.register_count = m.code.registers_size
       item.methods.append(x)
       manager.method_item_list[item.type + method_name + ','.join([str(z) for z in x.parameters])] = x
+      manager.method_refs[method_idx] = x
       manager.proto_item_list[return_type + "".join(parameter)] = x.create_proto()
     return item
 
@@ -185,9 +177,9 @@ class DexConverter(object):
   def create_dex_method(self, manager, parent, method_name, access_flags, proto_shorty, parameter, return_type, code):
     x = None
     if code:
-      #print('method : {}{}'.format(parent, method_name))
-      x = code_to_editor(manager, code)
-    m = normalize.DexMethod(parent, method_name, access_flags, proto_shorty, parameter, return_type, x)
+      # decoded on first get_editor()
+      x = RawCode(manager, code)
+    m = normalize.DexMethod(parent, method_name, access_flags, proto_shorty, parameter, return_type, None, self.dex.pool, x)
     return m
 
 
@@ -199,17 +191,11 @@ def translate_encoded_value(dex_pool, parent, manager, encoded_value):
   if _type == normalize.VALUE_TYPE_METHOD:
     #todo : get method from method pool
     #create_method(self, class_name, method_name, proto_shorty, parameter, return_type):
-    proto = manager.proto_list[value.proto_idx]
-    shorty = manager.string_list[proto.shorty_idx]
-    return_type = manager.type_list[proto.return_type_idx]
-    method_name = manager.string_list[value.name_idx]
-    parameters = []
-    class_type = manager.type_list[value.class_idx]
-    if proto.type_list:
-      for type_item in proto.type_list.list:
-        pt_idx = type_item.type_idx
-        type_info = manager.type_list[pt_idx]
-        parameters.append(type_info)
+    shorty = manager.get_proto_shorty(value.proto_idx)
+    return_type = manager.get_proto_return_type(value.proto_idx)
+    method_name = manager.get_method_name(value.index)
+    parameters = manager.get_proto_parameters(value.proto_idx)
+    class_type = manager.get_method_class(value.index)
     
     value = manager.create_method(class_type, method_name, shorty, parameters, return_type)
 
@@ -225,11 +211,11 @@ def translate_encoded_value(dex_pool, parent, manager, encoded_value):
 
   if _type == normalize.VALUE_TYPE_FIELD or _type == normalize.VALUE_TYPE_ENUM:
     #todo : get field from field pool
-    parent = manager.type_list[value.class_idx]
+    parent = manager.get_field_class(value.index)
     #parent = dex_pool.get_class(parent)
     
-    field_name = manager.string_list[value.name_idx]
-    type_name = manager.type_list[value.type_idx]
+    field_name = manager.get_field_name(value.index)
+    type_name = manager.get_field_type(value.index)
     access_flags = 0
     
     value = normalize.DexField(parent, field_name, type_name, access_flags)
@@ -248,9 +234,101 @@ def translate_encoded_value(dex_pool, parent, manager, encoded_value):
 def code_to_editor(manager, code):
   e = editor.Editor()
   e.manager = manager
+  if not isinstance(code, RawCode):
+    code = RawCode(manager, code)
   ir = CodeItemReader(e, manager, code)
   return e
 
+def read_try_blocks(editor_, manager, tries):
+  ret = []
+  for start_addr, insn_count, handlers, catch_all_addr in tries:
+    type_addrs = []
+    start = start_addr
+    end = start_addr + insn_count - 1
+    for type_idx, addr in handlers:
+      type_addrs.append(editor.DexHandlerTypeAddr(manager.type_list[type_idx], addr))
+    if catch_all_addr != -1:
+      type_addrs.append(editor.DexHandlerTypeAddr(None, catch_all_addr))
+
+    trycatch = editor.TryCatch(editor_, start, end, type_addrs, catch_all_addr)
+    for t_a_pair in type_addrs:
+      t_a_pair.handler = trycatch
+    ret.append(trycatch)
+  return ret
+
+class RawCode(object):
+  """
+    undecoded code item of method.
+    decoded to editor when method.editor is first accessed,
+    untouched methods are written by copying insns with index operands remapped.
+  """
+  def __init__(self, manager, code_item):
+    self.manager = manager
+    self.registers_size = code_item.registers_size
+    self.ins_size = code_item.ins_size
+    self.outs_size = code_item.outs_size
+    self.insns = code_item.insns
+    self.tries = []
+    for t in code_item.tries:
+      handlers = [(x.type_idx, x.addr) for x in t.handlers.handlers]
+      self.tries.append((t.start_addr, t.insn_count, handlers, t.handlers.catch_all_addr))
+    self.refs = None
+
+  def to_editor(self):
+    e = code_to_editor(self.manager, self)
+    for opcode in e.opcode_list:
+      opcode.set_ref_item()
+    e.modified = False
+    return e
+
+  def get_try_blocks(self):
+    """
+      try blocks without editor, for write
+    """
+    return read_try_blocks(None, self.manager, self.tries)
+
+  def get_refs(self):
+    """
+      (code unit index, operand code unit count, opcode, old index)
+      of each index operand, None if an opcode can not be copied as is
+    """
+    if self.refs is not None:
+      return self.refs
+    insns = self.insns
+    decode_table = base.DECODE_TABLE
+    ref_table = base.REF_OPERAND_TABLE
+    refs = []
+    index = 0
+    end = len(insns)
+    while index < end:
+      op = insns[index] & 0xff
+      width = decode_table[op][1]
+      if width == 0:
+        # nop or payload
+        opcode = base.Instruction10x(None)
+        opcode.from_insns(insns, index)
+        width = len(opcode) >> 1
+      else:
+        operand = ref_table[op]
+        if operand is None:
+          return None
+        if operand:
+          units = operand[1]
+          value = insns[index + 1]
+          if units == 2:
+            value |= insns[index + 2] << 16
+          refs.append((index, units, op, value))
+      index += width
+    self.refs = refs
+    return refs
+
+  def get_ref_items(self):
+    """
+      (opcode, referenced item) of each index operand
+    """
+    resolver = base.Instruction(self.manager)
+    return [(op, resolver.get_typeindex_item(op, value)) for index, units, op, value in self.get_refs()]
+
 
 class ByteCodeConverter(object):
   def __init__(self, manager):
@@ -287,60 +365,11 @@ class CodeStream(object):
     self.index = offset
 
 class CodeItemReader(object):
-  def __init__(self, editor_, manager, code_item):
+  def __init__(self, editor_, manager, code):
     self.tries = []
-    self.opcodes = []
     self.editor = editor_
     self.manager = manager
-    payload_size = 0
-    stream = CodeStream(code_item.insns)
-    #print('insns_size : {}'.format(code_item.insns_size))
-    insns_size = code_item.insns_size
-
-    while stream.index + payload_size < insns_size:
-      #print('stream.index : {}'.format(stream.index))
-      opcode = stream.peek() & 0xff
-
-      instruction = base.OpcodeFactory.from_stream(opcode, self.editor.manager, stream)
-      """
-
-      if instruction.op == 0x26: # fill-array-data
-        payload = base.FillArrayDataPayload(instruction)
-        payload.read(stream, instruction.BBBBBBBB + instruction.base_offset)
-        payload_size += payload.get_size()
-        instruction.payload = payload
-      elif instruction.op == 0x2b: #packed-switch
-        payload = base.PackedSwitchPayload(instruction)
-        payload.read(stream, instruction.BBBBBBBB + instruction.base_offset)
-        payload_size += payload.get_size()
-        instruction.payload = payload
-      elif instruction.op == 0x2c: #sparse-switch
-        payload = base.SparseSwitchPayload(instruction)
-        payload.read(stream, instruction.BBBBBBBB + instruction.base_offset)
-        payload_size += payload.get_size()
-        instruction.payload = payload
-      """
-      self.opcodes.append(instruction)
-
- 
-    if code_item.tries:
-      for t in code_item.tries:
-        type_addrs = []
-        start = t.start_addr
-        end = t.start_addr + t.insn_count - 1
-        catch_handlers = t.handlers
-        for type_addr_pair in catch_handlers.handlers:
-          type_idx, addr = type_addr_pair.type_idx, type_addr_pair.addr
-          type_addrs.append(editor.DexHandlerTypeAddr(self.manager.type_list[type_idx],type_addr_pair.addr))
-        catch_all_addr = catch_handlers.catch_all_addr
-        if catch_all_addr != -1:
-          type_addrs.append(editor.DexHandlerTypeAddr(None,catch_all_addr))
-
-        trycatch = editor.TryCatch(self.editor, start, end, type_addrs, catch_all_addr)
-        for t_a_pair in type_addrs:
-          t_a_pair.handler = trycatch
-
-        self.editor.tries.append(trycatch)
+    self.opcodes = base.decode_insns(self.editor.manager, code.insns)
+    self.editor.tries.extend(read_try_blocks(self.editor, self.manager, code.tries))
     self.editor.opcode_list = self.opcodes
-
-
+    self.editor.bind_labels()
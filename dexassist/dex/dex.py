@@ -1,7 +1,11 @@
 from zlib import adler32
+import mmap
 import struct
+import sys
+from array import array
 import inspect
 from .. import normalize
+from . import mutf8
 """
 parse dex
 
@@ -162,6 +166,12 @@ class StreamReader(object):
   ULONGLONG_FMT = '<Q'
   UBYTE_FMT = '<B'
   BYTE_FMT = '<b'
+  UBYTE_STRUCT = struct.Struct(UBYTE_FMT)
+  UINT_STRUCT = struct.Struct(UINT_FMT)
+  INT_STRUCT = struct.Struct(INT_FMT)
+  USHORT_STRUCT = struct.Struct(USHORT_FMT)
+  SHORT_STRUCT = struct.Struct(SHORT_FMT)
+  ULONGLONG_STRUCT = struct.Struct(ULONGLONG_FMT)
 
   def __init__(self, buf, manager):
     self.buf = buf
@@ -187,35 +197,27 @@ class StreamReader(object):
       MAGIC: self.read_magic,
       SIGNATURE: self.read_signature
     }
+
+
+  # primitives are decoded in place with unpack_from,
+  # so buf can be bytes, bytearray, mmap or memoryview without slicing
   def read_ubyte(self, index, *args):
-    ret = self.__read(index, 1, *args)
-    ret.value = struct.unpack(self.UBYTE_FMT, ret.value)[0]
-    return ret
+    return DexPrimitive(self.UBYTE_STRUCT.unpack_from(self.buf, index)[0], 1)
   
   def read_uint(self, index, *args):
-    ret = self.__read(index, 4, *args)
-    ret.value = struct.unpack(self.UINT_FMT, ret.value)[0]
-    return ret
+    return DexPrimitive(self.UINT_STRUCT.unpack_from(self.buf, index)[0], 4)
 
   def read_int(self, index, *args):
-    ret = self.__read(index, 4, *args)
-    ret.value = struct.unpack(self.INT_FMT, ret.value)[0]
-    return ret
+    return DexPrimitive(self.INT_STRUCT.unpack_from(self.buf, index)[0], 4)
 
   def read_ushort(self, index, *args):
-    ret = self.__read(index, 2, *args)
-    ret.value = struct.unpack(self.USHORT_FMT, ret.value)[0]
-    return ret
+    return DexPrimitive(self.USHORT_STRUCT.unpack_from(self.buf, index)[0], 2)
 
   def read_short(self, index, *args):
-    ret = self.__read(index, 2, *args)
-    ret.value = struct.unpack(self.SHORT_FMT, ret.value)[0]
-    return ret
+    return DexPrimitive(self.SHORT_STRUCT.unpack_from(self.buf, index)[0], 2)
 
   def read_ulong(self, index, *args):
-    ret = self.__read(index, 8, *args)
-    ret.value = struct.unpack(self.ULONGLONG_FMT, ret.value)[0]
-    return ret
+    return DexPrimitive(self.ULONGLONG_STRUCT.unpack_from(self.buf, index)[0], 8)
 
   def read_magic(self, index, *args):
     ret = self.__read(index, 8, *args)
@@ -248,36 +250,17 @@ class StreamReader(object):
     return ''.join(ret).encode('utf-8')
 
   def read_string(self, index):
-    s = 0
+    """
+      read null terminated mutf-8 string, value is utf-8 encoded bytes
+    """
     size = 0
-    ret = bytearray()
-    while True:
-      a = self.read_ubyte(index + size).value
+    while self.buf[index + size] != 0:
       size += 1
-      if a == 0:
-        x = self.decode_string(ret)
-        #print('return string : {}'.format(x))
-        return DexPrimitive(x, size)
-      if a >> 7 == 0:
-        ret.append(a & 0x7f)
-      elif a >> 5 == 0b110:
-        b = self.read_ubyte(index + size).value
-        size += 1
-        if (b & 0xc0) != 0x80:
-          raise Exception('BAD SECOND BYTE')
-        data = (((a & 0x1f) << 6) & 0xff) | b & 0x3f
-        ret.append(data)
-      elif a >> 4 == 0b1110:
-        b = self.read_ubyte(index + size).value
-        size += 1
-        c = self.read_ubyte(index + size).value
-        size += 1
-        if ((b & 0xc0) != 0x80) or ((c & 0xc0) != 0x80):
-          raise Exception('BAD THIRD BYTE')
-        data = (((a & 0xf) << 12) & 0xff) | ((( b & 0x3f) << 6) & 0xff) | c & 0x3f
-        ret.append(data)
-      else:
-        raise Exception('read string error')
+    raw = bytes(self.buf[index : index + size])
+    if raw.isascii():
+      return DexPrimitive(raw, size + 1)
+    x = mutf8.decode(raw).encode('utf-8', 'surrogatepass')
+    return DexPrimitive(x, size + 1)
 
   def read_sleb(self, index):
     result = 0
@@ -316,7 +299,7 @@ class StreamReader(object):
 
 
   def __read(self, index, size, *args):
-    return DexPrimitive(self.buf[index : index + size], size)
+    return DexPrimitive(bytes(self.buf[index : index + size]), size)
 
   def read_function(self, size):
     def __read(_self, index, *args):
@@ -406,6 +389,132 @@ class DexItem(object):
       ret += ' {} : {}\n'.format(x, getattr(self, x))
 
     return ret
+
+class LazyItem(object):
+  """
+  item referenced by offset, parsed on first access.
+  the parsed item replaces this descriptor in the instance dict,
+  so later accesses are plain attribute lookups.
+  """
+  def __init__(self, name, offset_name, item_class_name):
+    self.name = name
+    self.cache_name = '_' + name
+    self.offset_name = offset_name
+    self.item_class_name = item_class_name
+
+  def __get__(self, instance, owner):
+    if instance is None:
+      return self
+    cache = getattr(instance, '__dict__', None)
+    if cache is None:
+      # slotted record, parsed item is kept in cache_name slot
+      value = getattr(instance, self.cache_name, self)
+      if value is not self:
+        return value
+    value = None
+    offset = getattr(instance, self.offset_name)
+    if offset:
+      item_class = globals()[self.item_class_name]
+      value = item_class(instance.manager, instance.root_stream, offset)
+    if cache is None:
+      setattr(instance, self.cache_name, value)
+    else:
+      cache[self.name] = value
+    return value
+
+
+class RecordMeta(type):
+  """
+  compiles descriptor of DexRecord subclass.
+  descriptor fields and extra_slots become __slots__,
+  runs of fixed width fields are read with one precompiled struct.
+  """
+  FIXED_FORMAT = {
+    BYTE: 'B',
+    UBYTE: 'B',
+    SHORT: 'h',
+    USHORT: 'H',
+    INT: 'i',
+    UINT: 'I',
+    LONG: 'Q',
+    ULONG: 'Q',
+    MAGIC: '8s',
+    SIGNATURE: '20s'
+  }
+  def __new__(mcs, name, bases, namespace):
+    if '__slots__' not in namespace:
+      descriptor = namespace.get('descriptor', {})
+      slots = list(descriptor) + list(namespace.get('extra_slots', ()))
+      for value in namespace.values():
+        if isinstance(value, LazyItem):
+          slots.append(value.cache_name)
+      namespace['__slots__'] = tuple(slots)
+    cls = super(RecordMeta, mcs).__new__(mcs, name, bases, namespace)
+    cls.layout = mcs.compile(cls.descriptor)
+    return cls
+
+  @classmethod
+  def compile(mcs, descriptor):
+    """
+      layout is list of (struct, read_type, names),
+      struct is None for variable width field.
+    """
+    layout = []
+    fmt = ''
+    names = []
+    for name, read_type in descriptor.items():
+      if read_type in mcs.FIXED_FORMAT:
+        fmt += mcs.FIXED_FORMAT[read_type]
+        names.append(name)
+        continue
+      if names:
+        layout.append((struct.Struct('<' + fmt), None, tuple(names)))
+        fmt = ''
+        names = []
+      layout.append((None, read_type, (name,)))
+    if names:
+      layout.append((struct.Struct('<' + fmt), None, tuple(names)))
+    return layout
+
+
+class DexRecord(object, metaclass=RecordMeta):
+  """
+  slotted DexItem. fields are plain attributes and
+  manager, root_stream are not kept unless listed in extra_slots,
+  they are passed to parse_remain instead.
+  """
+  __slots__ = ('base_index', 'read_size')
+  descriptor = {}
+
+  def __init__(self, manager, root_stream, index):
+    self.base_index = index
+    self.read_property(root_stream)
+    self.parse_remain(manager, root_stream)
+
+  def parse_remain(self, manager, root_stream):
+    pass
+
+  def read_property(self, root_stream):
+    index = self.base_index
+    buf = root_stream.buf
+    for fixed, read_type, names in self.layout:
+      if fixed is None:
+        readobj = root_stream.read(index, read_type)
+        setattr(self, names[0], readobj.value)
+        index += readobj.read_size
+        continue
+      for name, value in zip(names, fixed.unpack_from(buf, index)):
+        setattr(self, name, value)
+      index += fixed.size
+    self.read_size = index - self.base_index
+
+  def __str__(self):
+    ret = ''
+    for x in self.descriptor:
+      ret += '{} : {}\n'.format(x, getattr(self, x))
+    return ret
+
+
 class EncodedValue(DexItem):
   descriptor = {
     'value_type': UBYTE
@@ -524,19 +633,208 @@ class AnnotationElement(DexItem):
     self.value = EncodedValue(self.manager, self.root_stream, self.base_index + self.read_size)
     self.read_size += self.value.read_size
 
-class ProtoIdItem(DexItem):
+class IdTable(object):
+  """
+  fixed size id items(string, type, proto, field, method ids) decoded in bulk.
+  every field of item_class.descriptor is kept in its own array column,
+  table[i] returns a row view(item_class) over the columns.
+  """
+  ARRAY_TYPECODE = {
+    USHORT: 'H',
+    UINT: 'I'
+  }
+  def __init__(self, item_class, manager, root_stream, offset, size):
+    self.item_class = item_class
+    self.manager = manager
+    self.root_stream = root_stream
+    self.size = size
+    self.rows = [None] * size
+    self.columns = {}
+    fmt = '<' + ''.join([self.ARRAY_TYPECODE[x] for x in item_class.descriptor.values()])
+    item_size = struct.calcsize(fmt)
+    columns = [()] * len(item_class.descriptor)
+    if size:
+      buf = memoryview(root_stream.buf)[offset : offset + item_size * size]
+      columns = list(zip(*struct.iter_unpack(fmt, buf)))
+      buf.release()
+    for name, column in zip(item_class.descriptor, columns):
+      self.columns[name] = array(self.ARRAY_TYPECODE[item_class.descriptor[name]], column)
+    self.read_size = item_size * size
+
+  def column(self, name):
+    return self.columns[name]
+
+  def __len__(self):
+    return self.size
+
+  def __getitem__(self, index):
+    row = self.rows[index]
+    if row is None:
+      row = self.item_class(self, index)
+      self.rows[index] = row
+    return row
+
+  def __iter__(self):
+    for index in range(self.size):
+      yield self[index]
+
+  def detach(self):
+    """
+      drop the stream reference, columns are already copied
+    """
+    self.root_stream = None
+
+  def __getstate__(self):
+    self.detach()
+    state = dict(self.__dict__)
+    state['rows'] = None
+    return state
+
+  def __setstate__(self, state):
+    self.__dict__.update(state)
+    self.rows = [None] * self.size
+
+
+class StringTable(object):
+  """
+  string_data_item values by string id, decoded when first accessed.
+  ascii strings(byte length == utf16_size) are decoded directly,
+  others go through mutf8.decode.
+  """
+  def __init__(self, root_stream, offsets):
+    self.buf = root_stream.buf
+    self.offsets = offsets
+    self.values = [None] * len(offsets)
+
+  def __len__(self):
+    return len(self.values)
+
+  def __getitem__(self, index):
+    value = self.values[index]
+    if value is None:
+      value = self.decode(self.offsets[index])
+      self.values[index] = value
+    return value
+
+  def __iter__(self):
+    for index in range(len(self.values)):
+      yield self[index]
+
+  def detach(self):
+    """
+      decode all remaining strings and drop the buffer
+    """
+    if self.buf is None:
+      return
+    for index in range(len(self.values)):
+      self[index]
+    self.buf = None
+    self.offsets = None
+
+  def __getstate__(self):
+    self.detach()
+    return self.__dict__
+
+  def decode(self, offset):
+    buf = self.buf
+    utf16_size = 0
+    shift = 0
+    while True:
+      b = buf[offset]
+      offset += 1
+      utf16_size |= (b & 0x7f) << shift
+      if b & 0x80 == 0: break
+      shift += 7
+
+    end = offset + utf16_size
+    if buf[end] == 0:
+      raw = bytes(buf[offset : end])
+      if raw.isascii():
+        return raw.decode('ascii')
+    # mutf-8 takes at most 3 bytes per utf-16 unit
+    raw = bytes(buf[offset : offset + utf16_size * 3 + 1])
+    return mutf8.decode(raw[:raw.index(0)])
+
+
+class IdRow(object):
+  """
+  one item of IdTable, fields are read from the table columns.
+  """
+  __slots__ = ('table', 'index')
+  descriptor = {}
+
+  def __init__(self, table, index):
+    self.table = table
+    self.index = index
+
+  @property
+  def manager(self):
+    return self.table.manager
+
+  def __getattr__(self, name):
+    if name not in self.descriptor:
+      raise AttributeError('{} is not exist in {}'.format(name, self.__class__.__name__))
+    return self.table.columns[name][self.index]
+
+  def __str__(self):
+    ret = ''
+    for x in self.descriptor:
+      ret += '{} : {}\n'.format(x, getattr(self, x))
+    return ret
+
+
+class ProtoIdItem(IdRow):
+  __slots__ = ()
   descriptor = {
     'shorty_idx': UINT,
     'return_type_idx': UINT,
     'parameters_off': UINT
   }
-  def parse_remain(self):
-    self.type_list = None
-    if self.parameters_off:
-      self.type_list = TypeList(self.manager, self.root_stream, self.parameters_off)
+  @property
+  def type_list(self):
+    return self.table.get_type_list(self.index)
+
+
+class ProtoIdTable(IdTable):
+  def __init__(self, manager, root_stream, offset, size):
+    super(ProtoIdTable, self).__init__(ProtoIdItem, manager, root_stream, offset, size)
+    self.type_lists = [None] * size
+    self.parameters = [None] * size
+
+  def detach(self):
+    for index in range(self.size):
+      self.get_parameters(index)
+    self.type_lists = [None] * self.size
+    super(ProtoIdTable, self).detach()
+
+  def get_type_list(self, index):
+    offset = self.columns['parameters_off'][index]
+    if not offset:
+      return None
+    ret = self.type_lists[index]
+    if ret is None:
+      if self.root_stream is None:
+        raise Exception('type list of proto {} is not available after detach'.format(index))
+      ret = TypeList(self.manager, self.root_stream, offset)
+      self.type_lists[index] = ret
+    return ret
+
+  def get_parameters(self, index):
+    """
+      return parameter type descriptors of proto
+    """
+    ret = self.parameters[index]
+    if ret is None:
+      type_list = self.get_type_list(index)
+      ret = []
+      if type_list:
+        ret = [self.manager.type_list[x.type_idx] for x in type_list.list]
+      self.parameters[index] = ret
+    return ret
 
 
-class FieldIdItem(DexItem):
+class FieldIdItem(IdRow):
+  __slots__ = ()
   descriptor = {
     'class_idx': USHORT,
     'type_idx': USHORT,
@@ -545,7 +843,8 @@ class FieldIdItem(DexItem):
   def get_name(self):
     return self.manager.string_list[self.name_idx]
 
-class MethodIdItem(DexItem):
+class MethodIdItem(IdRow):
+  __slots__ = ()
   descriptor = {
     'class_idx': USHORT,
     'proto_idx': USHORT,
@@ -567,21 +866,26 @@ class ClassDefItem(DexItem):
     'class_data_off': UINT,
     'static_values_off': UINT
   }
+  data = LazyItem('data', 'class_data_off', 'ClassDataItem')
+  annotations = LazyItem('annotations', 'annotations_off', 'AnnotationsDirectoryItem')
+  static_values = LazyItem('static_values', 'static_values_off', 'EncodedArrayItem')
+
   def parse_remain(self):
     #print('** parse class_idx {}'.format(self.manager.type_list[self.class_idx]))
-    self.data = None
-    if self.class_data_off:
-      self.data = ClassDataItem(self.manager, self.root_stream, self.class_data_off)
-    self.annotations = None
-    if self.annotations_off:
-      self.annotations = AnnotationsDirectoryItem(self.manager, self.root_stream, self.annotations_off)
-    self.static_values = None
-    if self.static_values_off:
-      self.static_values = EncodedArrayItem(self.manager, self.root_stream, self.static_values_off)
     self.interfaces = []
     if self.interfaces_off:
       tl = TypeList(self.manager, self.root_stream, self.interfaces_off)
       self.interfaces = [x.type_idx for x in tl.list]
+    if not self.manager.lazy:
+      self.load()
+
+  def load(self):
+    """
+      parse class data, annotations and static values now.
+      called from parse_remain() unless the manager is lazy.
+    """
+    for name in ['data', 'annotations', 'static_values']:
+      getattr(self, name)
   def __str__(self):
     return 'Class@' + self.manager.type_list[self.class_idx]
 
@@ -623,16 +927,24 @@ class EncodedField(DexItem):
     'access_flags': ULEB
   }
 
-class EncodedMethod(DexItem):
+class EncodedMethod(DexRecord):
   descriptor = {
     'method_idx_diff': ULEB,
     'access_flags': ULEB,
     'code_off': ULEB
   }
-  def parse_remain(self):
-    self.code = None
-    if self.code_off:
-      self.code = CodeItem(self.manager, self.root_stream, self.code_off)
+  # kept for lazy code parsing
+  extra_slots = ('manager', 'root_stream')
+  code = LazyItem('code', 'code_off', 'CodeItem')
+
+  def parse_remain(self, manager, root_stream):
+    self.manager = manager
+    self.root_stream = root_stream
+    if not manager.lazy:
+      self.load()
+
+  def load(self):
+    return self.code
 
 class TypeList(DexItem):
   descriptor = {
@@ -651,7 +963,7 @@ class TypeItem(DexItem):
     'type_idx': USHORT
   }
 
-class CodeItem(DexItem):
+class CodeItem(DexRecord):
   descriptor = {
     'registers_size': USHORT,
     'ins_size': USHORT,
@@ -660,33 +972,35 @@ class CodeItem(DexItem):
     'debug_info_off': UINT,
     'insns_size': UINT
   }
+  extra_slots = ('insns', 'padding', 'tries', 'handlers')
 
-  def parse_remain(self):
+  def parse_remain(self, manager, root_stream):
     #print('codesize {}'.format(self.insns_size))
-    self.insns = []
     self.padding = 0
     self.tries = []
     self.handlers = None
     
-    for x in range(self.insns_size):
-      item = self.root_stream.read_ushort(self.base_index + self.read_size)
-      self.insns.append(item.value)
-      self.read_size += item.read_size
-    #print('read instruction finished')
+    # code units in one slice, frombytes() also reads memoryview(mmap) as bytes
+    start = self.base_index + self.read_size
+    self.insns = array('H')
+    self.insns.frombytes(root_stream.buf[start : start + self.insns_size * 2])
+    if sys.byteorder == 'big':
+      self.insns.byteswap()
+    self.read_size += self.insns_size * 2
     if self.tries_size != 0 and self.insns_size % 2 == 1:
       self.padding = 0
       self.read_size += 2
     for x in range(self.tries_size):
-      item = TryItem(self.manager, self.root_stream, self.base_index + self.read_size)
+      item = TryItem(manager, root_stream, self.base_index + self.read_size)
       self.tries.append(item)
       self.read_size += item.read_size
     #print('tries finished, parse size was {}'.format(self.tries_size))
     if self.tries_size:
-      self.handlers = EncodedCatchHandlerList(self.manager, self.root_stream, self.base_index + self.read_size)
+      self.handlers = EncodedCatchHandlerList(manager, root_stream, self.base_index + self.read_size)
       self.read_size += self.handlers.read_size
       
     for x in self.tries:
-      x.handlers = EncodedCatchHandler(self.manager, self.root_stream, x.handler_off + self.handlers.base_index)
+      x.handlers = EncodedCatchHandler(manager, root_stream, x.handler_off + self.handlers.base_index)
     #print('parse finished')
     
 class TryItem(DexItem):
@@ -862,13 +1176,15 @@ class HiddenapiClassDataItem(DexItem):
     self.flags = []
 
 class DexManager(object):
-  def __init__(self):
+  def __init__(self, lazy=False):
+    self.lazy = lazy
     self.string_list = []
     self.type_list = []
     self.proto_list = []
     self.field_list = []
     self.method_list = []
     self.class_def_list = []
+    self.class_def_map = {}
     self.method_item_list = {}
     self.field_item_list = {}
     self.proto_item_list = {}
@@ -880,6 +1196,58 @@ class DexManager(object):
     self.externel_proto_list = set()
     self.externel_class_list = {}
     self.externel_type_list_list = []
+    # method_idx/field_idx -> resolved DexMethod/DexField
+    self.method_refs = {}
+    self.field_refs = {}
+    # normalize.ReferencePool of converted dex
+    self.pool = None
+    self.mapping = None
+    self.view = None
+
+  def merge_externel(self, other):
+    """
+      add external references of other manager, for merged dex
+    """
+    for name in other.externel_class_list:
+      self.externel_class_list.setdefault(name, other.externel_class_list[name])
+    self.externel_method_list.extend(other.externel_method_list)
+    self.externel_field_list.extend(other.externel_field_list)
+    self.externel_type_list.update(other.externel_type_list)
+    self.externel_string_list.update(other.externel_string_list)
+    self.externel_proto_list.update(other.externel_proto_list)
+    self.externel_type_list_list.extend(other.externel_type_list_list)
+
+  def detach(self):
+    """
+      make the decoded tables independent from the dex buffer
+    """
+    for table in [self.string_list, self.proto_list, self.field_list, self.method_list]:
+      if hasattr(table, 'detach'):
+        table.detach()
+
+  def __getstate__(self):
+    """
+      raw parse items(class_def_list) and the mapping are not kept
+    """
+    self.detach()
+    state = dict(self.__dict__)
+    state['class_def_list'] = []
+    state['class_def_map'] = {}
+    state['mapping'] = None
+    state['view'] = None
+    return state
+
+  def close(self):
+    """
+      release the mapped file of from_mapped_file()
+    """
+    self.detach()
+    if self.view is not None:
+      self.view.release()
+      self.view = None
+    if self.mapping is not None:
+      self.mapping.close()
+      self.mapping = None
     
   def get_string(self, index):
     return self.string_list[index]
@@ -897,64 +1265,87 @@ class DexManager(object):
     return self.method_list[index]
   def get_class_def_by_index(self, index):
     return self.class_def_list[index]
+  def get_class_def_by_type(self, class_type):
+    return self.class_def_map.get(class_type)
+
+  # index based accessors over the id table columns
+  def get_proto_shorty(self, index):
+    return self.string_list[self.proto_list.column('shorty_idx')[index]]
+  def get_proto_return_type(self, index):
+    return self.type_list[self.proto_list.column('return_type_idx')[index]]
+  def get_proto_parameters(self, index):
+    return list(self.proto_list.get_parameters(index))
+  def get_field_class(self, index):
+    return self.type_list[self.field_list.column('class_idx')[index]]
+  def get_field_type(self, index):
+    return self.type_list[self.field_list.column('type_idx')[index]]
+  def get_field_name(self, index):
+    return self.string_list[self.field_list.column('name_idx')[index]]
+  def get_method_class(self, index):
+    return self.type_list[self.method_list.column('class_idx')[index]]
+  def get_method_proto_index(self, index):
+    return self.method_list.column('proto_idx')[index]
+  def get_method_name(self, index):
+    return self.string_list[self.method_list.column('name_idx')[index]]
+
   def get_proto_dex_item_by_index(self, index):
-    return self.proto_item_list[self.string_list[self.proto_list[index].shorty_idx]]
+    return self.proto_item_list[self.get_proto_shorty(index)]
   def get_method_dex_item_by_index(self, index):
-    target = self.method_list[index]
-    method_name = self.string_list[target.name_idx]
-    proto = self.proto_list[target.proto_idx]
-    proto_shorty = self.string_list[proto.shorty_idx]
-    return_type_idx = proto.return_type_idx
-    parameter = []
-    return_type = self.type_list[return_type_idx]
-    if proto.type_list:
-      for type_item in proto.type_list.list:
-        parameter_type_idx = type_item.type_idx
-        type_info = self.type_list[parameter_type_idx]
-        parameter.append(type_info)
-    try:
-      return self.method_item_list[self.type_list[target.class_idx] + \
-        method_name + ','.join([str(x) for x in self.parameters])]
-    except:
-      
-      m = self.create_method(self.type_list[self.method_list[index].class_idx], method_name, proto_shorty, parameter, return_type)
+    """
+      method_id is resolved once, defined methods are registered
+      by the converter and others become one external DexMethod.
+    """
+    m = self.method_refs.get(index)
+    if m is not None:
+      return m
+    method_name = self.get_method_name(index)
+    proto_idx = self.get_method_proto_index(index)
+    proto_shorty = self.get_proto_shorty(proto_idx)
+    parameter = self.get_proto_parameters(proto_idx)
+    return_type = self.get_proto_return_type(proto_idx)
+    class_type = self.get_method_class(index)
+    m = self.method_item_list.get(class_type + method_name + ','.join(parameter))
+    if m is None:
+      m = self.create_method(class_type, method_name, proto_shorty, parameter, return_type)
       self.externel_type_list.update(parameter)
       self.externel_proto_list.add(m.create_proto())
       self.externel_type_list_list.append(m.params)
       self.externel_type_list.update(parameter)
-      self.externel_type_list.add(self.type_list[self.method_list[index].class_idx])
+      self.externel_type_list.add(class_type)
       self.externel_type_list.add(return_type)
       self.externel_string_list.add(m.proto.shorty)
       self.externel_string_list.add(method_name)
-      self.externel_string_list.add(self.type_list[self.method_list[index].class_idx])
+      self.externel_string_list.add(class_type)
       self.externel_string_list.add(return_type)
       self.externel_string_list.update(parameter)
-
-      return m
+    self.method_refs[index] = m
+    return m
 
   def get_field_dex_item_by_index(self, index):
-    try:
-      return self.field_item_list[self.string_list[self.field_list[index].name_idx] + self.type_list[self.field_list[index].class_idx]]
-    except:
-      target = self.field_list[index]
-      target_class = self.type_list[target.class_idx]
-      target_name = self.string_list[target.name_idx]
-      target_type = self.type_list[target.type_idx]
+    f = self.field_refs.get(index)
+    if f is not None:
+      return f
+    target_class = self.get_field_class(index)
+    target_name = self.get_field_name(index)
+    f = self.field_item_list.get(target_name + target_class)
+    if f is None:
+      target_type = self.get_field_type(index)
       f = self.create_field(target_class, target_name, target_type)
       self.externel_type_list.add(target_class)
       self.externel_string_list.add(target_class)
       self.externel_field_list.append(f)
       self.externel_string_list.add(target_name)
-      return f
+    self.field_refs[index] = f
+    return f
 
   def create_method(self, class_name, method_name, proto_shorty, parameter, return_type):
     if class_name in self.externel_class_list.keys():
-      return normalize.DexMethod(self.externel_class_list[class_name], method_name, 0, proto_shorty, parameter, return_type, 0)
+      return normalize.DexMethod(self.externel_class_list[class_name], method_name, 0, proto_shorty, parameter, return_type, 0, self.pool)
     nclass = normalize.DexClassItem()
     nclass.name = class_name
     nclass.type = class_name
     self.externel_class_list[class_name] = nclass
-    return normalize.DexMethod(nclass, method_name, 0, proto_shorty, parameter, return_type, 0)
+    return normalize.DexMethod(nclass, method_name, 0, proto_shorty, parameter, return_type, 0, self.pool)
     
 
   def create_field(self, class_name, target_name, target_type):
@@ -966,7 +1357,7 @@ class DexManager(object):
     self.externel_class_list[class_name] = nclass
     return normalize.DexField(nclass, target_name, target_type, 0)
 
-class HeaderItem(DexItem):
+class HeaderItem(DexRecord):
   descriptor = {
     'magic': MAGIC,
     'checksum': UINT,
@@ -993,50 +1384,34 @@ class HeaderItem(DexItem):
     'data_off': UINT
   }
 
-  def __init__(self, manager, root_stream, index):
-    super(HeaderItem, self).__init__(manager, root_stream, index)
+  extra_slots = ('manager', 'string_ids', 'type_ids', 'map_list')
 
-    index = self.string_ids_off
-    self.manager.string_list = []
-    for x in range(self.string_ids_size):
-      item = StringIdItem(self.manager, self.root_stream, index)
-      self.manager.string_list.append(item.get_value().value.decode('utf-8'))
-      index += item.read_size
+  def parse_remain(self, manager, root_stream):
+    self.manager = manager
+    self.map_list = None
 
-    index = self.type_ids_off
-    self.type_list = []
-    for x in range(self.type_ids_size):
-      item = TypeIdItem(self.manager, self.root_stream, index)
-      self.manager.type_list.append(self.manager.get_string(item.descriptor_idx))
-      index += item.read_size
+    self.string_ids = IdTable(StringIdItem, manager, root_stream, self.string_ids_off, self.string_ids_size)
+    manager.string_list = StringTable(root_stream, self.string_ids.column('string_data_off'))
 
-    index = self.proto_ids_off
-    for x in range(self.proto_ids_size):
-      item = ProtoIdItem(self.manager, self.root_stream, index)
-      self.manager.proto_list.append(item)
-      index += item.read_size
-    index = self.field_ids_off
-    for x in range(self.field_ids_size):
-      item = FieldIdItem(self.manager, self.root_stream, index)
-      self.manager.field_list.append(item)
-      index += item.read_size
+    self.type_ids = IdTable(TypeIdItem, manager, root_stream, self.type_ids_off, self.type_ids_size)
+    string_list = manager.string_list
+    manager.type_list = [string_list[x] for x in self.type_ids.column('descriptor_idx')]
 
-    index = self.method_ids_off
-    for x in range(self.method_ids_size):
-      item = MethodIdItem(self.manager, self.root_stream, index)
-      self.manager.method_list.append(item)
-      index += item.read_size
+    manager.proto_list = ProtoIdTable(manager, root_stream, self.proto_ids_off, self.proto_ids_size)
+    manager.field_list = IdTable(FieldIdItem, manager, root_stream, self.field_ids_off, self.field_ids_size)
+    manager.method_list = IdTable(MethodIdItem, manager, root_stream, self.method_ids_off, self.method_ids_size)
 
     index = self.class_defs_off
     for x in range(self.class_defs_size):
-      item = ClassDefItem(self.manager, self.root_stream, index)
-      self.manager.class_def_list.append(item)
+      item = ClassDefItem(manager, root_stream, index)
+      manager.class_def_list.append(item)
+      manager.class_def_map[manager.type_list[item.class_idx]] = item
       index += item.read_size
 
-    self.manager.data_off = self.data_off
+    manager.data_off = self.data_off
 
     if self.map_off != 0:
-      self.map_list = MapList(self.manager, root_stream, self.map_off)
+      self.map_list = MapList(manager, root_stream, self.map_off)
 
 
 
@@ -1067,7 +1442,8 @@ class MapList(DexItem):
   def get_string(self, index):
     string_id_items = self.list[TYPE_STRING_ID_ITEM]
 
-class TypeIdItem(DexItem):
+class TypeIdItem(IdRow):
+  __slots__ = ()
   descriptor = {
     'descriptor_idx': UINT
   }
@@ -1091,13 +1467,7 @@ class MapItem(DexItem):
     if self.type == TYPE_STRING_ID_ITEM:
       pass
     elif self.type == TYPE_TYPE_ID_ITEM:
-      index = self.offset
-      self.type_list = []
-      for x in range(self.size):
-        item = TypeIdItem(self.manager, self.root_stream, index)
-        #print("get type index {}".format(item.descriptor_idx))
-        self.type_list.append(self.manager.get_string(item.descriptor_idx))
-        index += item.read_size
+      self.type_list = self.manager.type_list
 
     elif self.type == TYPE_PROTO_ID_ITEM:
       pass
@@ -1135,19 +1505,15 @@ class MapItem(DexItem):
       pass
 
 
-class StringIdItem(DexItem):
+class StringIdItem(IdRow):
+  __slots__ = ()
   descriptor = {
     'string_data_off': UINT
   }
-  def __init__(self, manager, root_stream, index):
-    super(StringIdItem, self).__init__(manager, root_stream, index)
-    self.string_value = None
 
   def get_value(self):
-    if self.string_value is None:
-      v = StringDataItem(self.manager, self.root_stream, self.string_data_off)
-      self.string_value = v.value
-    return self.string_value
+    v = StringDataItem(self.manager, self.table.root_stream, self.string_data_off)
+    return v.value
 
 class StringDataItem(DexItem):
   descriptor = {
@@ -1158,12 +1524,63 @@ class StringDataItem(DexItem):
     self.value = root_stream.read_string(index + self.read_size)
 
 
-def from_memory(buf, converter):
-  manager = DexManager()
+def from_memory(buf, converter, lazy=False, cache=None):
+  """
+    lazy=True only indexes class_defs, class data, code items and
+    annotations are parsed when first accessed.
+    returns HeaderItem if converter is None.
+    cache(cache.ParseCache) returns the converted dex without parsing
+    when the same dex was converted before, it is not used in lazy mode.
+  """
+  key = None
+  if cache is not None and converter is not None and not lazy:
+    key = cache.get_key(buf)
+    ret = cache.load(key)
+    if ret is not None:
+      return ret
+  manager = DexManager(lazy)
   stream = StreamReader(buf, manager)
   header = HeaderItem(manager, stream, 0)
-  return converter.get_dex(header, manager)
-def from_file(path, converter):
+  if converter is None:
+    return header
+  ret = converter.get_dex(header, manager)
+  if key is not None:
+    cache.store(key, ret)
+  return ret
+def from_file(path, converter, lazy=False, cache=None):
   with open(path, 'rb') as f:
     x = f.read()
-    return from_memory(x, converter)
+    return from_memory(x, converter, lazy, cache)
+def from_mapped_file(path, converter, lazy=False, cache=None):
+  """
+    same as from_file(), but the file is mmap'ed and read in place
+    through a memoryview instead of being copied into memory.
+    the mapping is closed after conversion, in lazy mode it stays open
+    until manager.close() is called.
+    returns HeaderItem if converter is None, raw items are read from the
+    mapping then, so it stays open even if lazy is False and the caller
+    closes it by header.manager.close().
+  """
+  with open(path, 'rb') as f:
+    mapping = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+  key = None
+  if cache is not None and converter is not None and not lazy:
+    key = cache.get_key(mapping)
+    ret = cache.load(key)
+    if ret is not None:
+      mapping.close()
+      return ret
+  manager = DexManager(lazy)
+  manager.mapping = mapping
+  manager.view = memoryview(mapping)
+  stream = StreamReader(manager.view, manager)
+  header = HeaderItem(manager, stream, 0)
+  if converter is None:
+    # caller owns the mapping
+    return header
+  ret = converter.get_dex(header, manager)
+  if not lazy:
+    manager.close()
+  if key is not None:
+    cache.store(key, ret)
+  return ret
@@ -0,0 +1,87 @@
+"""
+load every dex of apk or directory, each dex is converted in worker process
+
+```
+d = loader.load('app.apk')
+for clazz in d.classes:
+  print(clazz.name)
+```
+"""
+import os
+import re
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+
+from dexassist import normalize
+from dexassist.dex import dex
+from dexassist.dex import converter
+
+DEX_NAME_PATTERN = re.compile(r'^classes(\d*)\.dex$')
+
+def get_dex_order(name):
+  """
+    classes.dex, classes2.dex, ... classesN.dex first, then other dex by name
+  """
+  m = DEX_NAME_PATTERN.match(os.path.basename(name))
+  if m is None:
+    return (1, 0, name)
+  return (0, int(m.group(1) or 1), name)
+
+def get_dex_entries(path):
+  """
+    returns list of (path, zip entry name or None)
+  """
+  if os.path.isdir(path):
+    names = [x for x in os.listdir(path) if x.endswith('.dex')]
+    names.sort(key=get_dex_order)
+    return [(os.path.join(path, x), None) for x in names]
+  if zipfile.is_zipfile(path):
+    with zipfile.ZipFile(path, 'r') as f:
+      names = [x for x in f.namelist() if DEX_NAME_PATTERN.match(x)]
+    names.sort(key=get_dex_order)
+    return [(path, x) for x in names]
+  return [(path, None)]
+
+def convert_entry(path, entry, converter_=None, cache=None):
+  if converter_ is None:
+    converter_ = converter.DexConverter()
+  if entry is None:
+    return dex.from_mapped_file(path, converter_, cache=cache)
+  with zipfile.ZipFile(path, 'r') as f:
+    buf = f.read(entry)
+  return dex.from_memory(buf, converter_, cache=cache)
+
+def load_dex_list(path, converter_=None, max_workers=None, cache=None):
+  """
+    returns normalize.Dex of each dex in classes.dex, classes2.dex, ... order.
+    converted dex is sent back from worker by pickle,
+    so it does not hold the dex buffer(see DexManager.detach)
+  """
+  entries = get_dex_entries(path)
+  if len(entries) <= 1 or max_workers == 1:
+    return [convert_entry(x, y, converter_, cache) for x, y in entries]
+  with ProcessPoolExecutor(max_workers=max_workers) as executor:
+    futures = [executor.submit(convert_entry, x, y, converter_, cache) for x, y in entries]
+    return [x.result() for x in futures]
+
+def merge(dex_list):
+  """
+    one normalize.Dex with classes of all dex,
+    class defined in earlier dex wins like the runtime class loader.
+  """
+  manager = dex.DexManager()
+  ret = normalize.Dex(manager)
+  defined = set()
+  for d in dex_list:
+    manager.merge_externel(d.manager)
+    for clazz in d.classes:
+      if clazz.type in defined: continue
+      defined.add(clazz.type)
+      ret.add_class(clazz)
+  return ret
+
+def load(path, converter_=None, max_workers=None, cache=None):
+  """
+    path is apk(zip), directory of dex files or dex file
+  """
+  return merge(load_dex_list(path, converter_, max_workers, cache))
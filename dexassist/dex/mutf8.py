@@ -3,35 +3,38 @@ def decode(b):
     ord_array = [None] * size
     ord_index = 0
 
-    b = iter(b)
-
-    for x in b:
+    index = 0
+    while index < size:
+        x = b[index]
         if x >> 7 == 0:
             # Single char:
             ord_array[ord_index] = x & 0x7f
+            index += 1
         elif x >> 5 == 0b110:
             # 2 byte Multichar
-            b2 = next(b)
-            if b2 >> 6 != 0b10:
-                raise UnicodeDecodeError(
+            if index + 1 >= size or b[index + 1] >> 6 != 0b10:
+                raise UnicodeDecodeError('mutf-8', bytes(b), index, index + 2,
                     "Second byte of 2 byte sequence does not looks right.")
-
+            b2 = b[index + 1]
             ord_array[ord_index] = (x & 0x1f) << 6 | b2 & 0x3f
+            index += 2
         elif x >> 4 == 0b1110:
             # 3 byte Multichar
-            b2 = next(b)
-            b3 = next(b)
-            if b2 >> 6 != 0b10:
-                raise UnicodeDecodeError(
+            if index + 2 >= size or b[index + 1] >> 6 != 0b10:
+                raise UnicodeDecodeError('mutf-8', bytes(b), index, index + 3,
                     "Second byte of 3 byte sequence does not looks right.")
+            b2 = b[index + 1]
+            b3 = b[index + 2]
             if b3 >> 6 != 0b10:
-                raise UnicodeDecodeError(
+                raise UnicodeDecodeError('mutf-8', bytes(b), index, index + 3,
                     "Third byte of 3 byte sequence does not looks right.")
 
             ord_array[ord_index] = (x & 0xf) << 12 | (
                 b2 & 0x3f) << 6 | b3 & 0x3f
+            index += 3
         else:
-            raise UnicodeDecodeError("Could not decode byte")
+            raise UnicodeDecodeError('mutf-8', bytes(b), index, index + 1,
+                "Could not decode byte")
         ord_index += 1
 
     chr_array = [""]*size
@@ -59,10 +59,40 @@ ACC_DECLARED_SYNCHRONIZED = 0x2000
 
 
 
+class ReferencePool(object):
+  """
+  interned type descriptors, parameter tuples and protos of one Dex
+  """
+  def __init__(self):
+    self.types = {}
+    self.type_lists = {}
+    self.protos = {}
+
+  def get_type(self, type_name):
+    return self.types.setdefault(type_name, type_name)
+
+  def get_type_list(self, types):
+    key = tuple(types)
+    ret = self.type_lists.get(key)
+    if ret is None:
+      ret = tuple([self.get_type(x) for x in key])
+      self.type_lists[ret] = ret
+    return ret
+
+  def get_proto(self, shorty, return_type, parameters):
+    parameters = self.get_type_list(parameters)
+    key = (return_type, parameters)
+    ret = self.protos.get(key)
+    if ret is None:
+      ret = DexProto(shorty, self.get_type(return_type), parameters)
+      self.protos[key] = ret
+    return ret
+
 class Dex(object):
   def __init__(self, manager):
     self.classes = []
     self.manager = manager
+    self.pool = ReferencePool()
 
   def save_as(self, write_class, stream):
     p = write_class(self)
@@ -73,8 +103,14 @@ class Dex(object):
   def get_class(self, clazz_type):
     for clazz in self.classes:
       if clazz.type == clazz_type: return clazz
+  def get_dirty_classes(self):
+    """
+      classes changed after they were parsed or saved incrementally
+    """
+    return [x for x in self.classes if x.is_dirty()]
 class DexClassItem(object):
   def __init__(self):
+    self._hash = None
     self.index = NO_INDEX
     self.annotations = []
     self.methods = []
@@ -90,6 +126,7 @@ class DexClassItem(object):
     self.interfaces = []
     self.static_initializers = None
     self.annotation_dir_offset = NO_OFFSET
+    self.dirty = False
   def __lt__(self, other):
     return str(self.type) < str(other.type)
   def __gt__(self, other):
@@ -130,6 +167,19 @@ class DexClassItem(object):
     return list(filter(lambda x : not x.is_direct_method(), self.methods))
 
 
+  @property
+  def name(self):
+    return self._name
+  @name.setter
+  def name(self, value):
+    # hash of class and members depends on the class name
+    self._name = value
+    self._hash = None
+    for x in self.methods:
+      x._hash = None
+    for x in self.fields:
+      x._hash = None
+
   def set_name(self):
     return self.name
   def add_annotation(self, annotation):
@@ -137,9 +187,31 @@ class DexClassItem(object):
   def __str__(self):
     return self.name
   def fix(self):
-    pass
+    """
+      called before write, applies pending opcode edits
+    """
+    for x in self.methods:
+      if x.is_decoded() and x.editor:
+        x.editor.commit()
+  def is_dirty(self):
+    """
+      True if class is marked or code of any method is dirty
+    """
+    if self.dirty:
+      return True
+    for x in self.methods:
+      if x.is_dirty():
+        return True
+    return False
+  def mark_dirty(self):
+    self.dirty = True
+  def clear_dirty(self):
+    # methods are cleared when their code is rebased
+    self.dirty = False
   def __hash__(self):
-    return hash(self.name)
+    if self._hash is None:
+      self._hash = hash(self.name)
+    return self._hash
   def __eq__(self,othr):
     if(hash(othr) == hash(self)):
       return True
@@ -160,14 +232,24 @@ class DexClassItem(object):
       for ele in ann.elements:
         ret.add(ele[0])
     for x in self.methods:
-      editor = x.get_editor()
-      if editor is None: continue
-      for try_item in editor.tries:
-        for handler in try_item.catch_handlers:
-          ret.add(handler.exception_type)
-      for opcode in editor.opcodes:
-        if opcode.op == OP_CONST_STRING:
-          ret.add(opcode.BBBB)
+      code = x.get_raw_code()
+      if code is not None and code.get_refs() is not None:
+        # without decoding
+        for try_item in code.get_try_blocks():
+          for handler in try_item.catch_handlers:
+            ret.add(handler.exception_type)
+        for op, item in code.get_ref_items():
+          if op == OP_CONST_STRING:
+            ret.add(item)
+      else:
+        editor = x.get_editor()
+        if editor is None: continue
+        for try_item in editor.tries:
+          for handler in try_item.catch_handlers:
+            ret.add(handler.exception_type)
+        for opcode in editor.opcodes:
+          if opcode.op == OP_CONST_STRING:
+            ret.add(opcode.BBBB)
       for ann in x.annotations:
         ret.add(ann.type)
         for ele in ann.elements:
@@ -193,12 +275,28 @@ class DexClassItem(object):
 
 class DexField(object):
   def __init__(self, parent, field_name, type_name, access_flags):
+    self._hash = None
     self.annotations = []
     self.name = field_name
     self.type = type_name
     self.clazz = parent
     self.access_flags = access_flags
   
+  @property
+  def name(self):
+    return self._name
+  @name.setter
+  def name(self, value):
+    self._name = value
+    self._hash = None
+  @property
+  def clazz(self):
+    return self._clazz
+  @clazz.setter
+  def clazz(self, value):
+    self._clazz = value
+    self._hash = None
+
   def is_static(self):
     return self.access_flags & 0x8
 
@@ -212,23 +310,36 @@ class DexField(object):
       ret += ''.join(a)
     return ret
   def __hash__(self):
+    if self._hash is not None:
+      return self._hash
     try:
-      return hash(self.name + self.clazz.name)
+      self._hash = hash(self.name + self.clazz.name)
     except:
       # for external field:
-      return hash(str(self.name + self.clazz))
+      self._hash = hash(str(self.name + self.clazz))
+    return self._hash
   def __eq__(self,othr):
     if(hash(othr) == hash(self)):
       return True
     return False
     
 class DexMethod(object):
-  def __init__(self, parent, method_name, access_flags, proto_shorty, parameter, return_t, editor):
+  """
+  with pool(ReferencePool), proto and parameter tuple are shared
+  between methods of the same signature.
+  code is undecoded code(RawCode), editor is decoded from it when first accessed.
+  """
+  def __init__(self, parent, method_name, access_flags, proto_shorty, parameter, return_t, editor, pool=None, code=None):
+    self._hash = None
     self.annotations = []
     self.name = method_name
     self.clazz = parent
-    self.return_type = return_t
-    self.params = parameter
+    if pool is None:
+      self.proto = DexProto(proto_shorty, return_t, parameter)
+    else:
+      self.proto = pool.get_proto(proto_shorty, return_t, parameter)
+    self.return_type = self.proto.return_type
+    self.params = self.proto.parameters
     self.parameters = self.params
     self.shorty = proto_shorty
     self.make_signature()
@@ -237,9 +348,86 @@ class DexMethod(object):
     self.param_annotations = []
     self.annotation_set_ref_list_offset = NO_OFFSET
     self.editor = editor
+    self.code = code
+    self.dirty = False
     self.code_item_offset = NO_OFFSET
-    self.proto = DexProto(self.shorty, self.return_type, self.params)
-  
+
+  @property
+  def name(self):
+    return self._name
+  @name.setter
+  def name(self, value):
+    self._name = value
+    self._hash = None
+  @property
+  def clazz(self):
+    return self._clazz
+  @clazz.setter
+  def clazz(self, value):
+    self._clazz = value
+    self._hash = None
+  @property
+  def editor(self):
+    if self._editor is None and self.code is not None:
+      # code is kept, it is written again while the editor is clean
+      self._editor = self.code.to_editor()
+      self._state = self._editor.get_state()
+    return self._editor
+  @editor.setter
+  def editor(self, value):
+    self._editor = value
+    self._state = None
+    self.code = None
+
+  def is_decoded(self):
+    return self._editor is not None or self.code is None
+  def get_raw_code(self):
+    """
+      undecoded code, None after editor is decoded
+    """
+    if self._editor is not None:
+      return None
+    return self.code
+
+  def is_dirty(self):
+    """
+      True if code was changed after it was parsed or saved incrementally.
+      pending edits, commit() and invalidate() of editor are tracked,
+      opcodes changed in place are found by comparing with state of the editor
+      taken when it was decoded
+    """
+    if self.code is None:
+      # new, abstract or native
+      return self._editor is not None
+    if self.dirty:
+      return True
+    editor = self._editor
+    if editor is None:
+      return False
+    if editor.modified or editor.has_pending():
+      return True
+    return editor.get_state() != self._state
+  def mark_dirty(self):
+    self.dirty = True
+  def clear_dirty(self):
+    self.dirty = False
+    if self._editor is not None:
+      self._editor.modified = False
+      self._state = self._editor.get_state()
+  def get_clean_code(self):
+    """
+      undecoded code which is still same as editor, for incremental save
+    """
+    if self.is_dirty():
+      return None
+    return self.code
+  def rebase(self, code):
+    """
+      code is as written by incremental save, None if it can not be copied
+    """
+    self.code = code
+    self.clear_dirty()
+
   def get_instructions(self):
     if self.editor:
       return self.editor.opcodes
@@ -290,7 +478,9 @@ class DexMethod(object):
     return ret
   
   def __hash__(self):
-    return hash(self.clazz.name + self.name + ','.join(str(x) for x in self.parameters))
+    if self._hash is None:
+      self._hash = hash(self.clazz.name + self.name + ','.join(str(x) for x in self.parameters))
+    return self._hash
   def __eq__(self,othr):
     if(hash(self) == hash(othr)):
       return True
@@ -298,11 +488,14 @@ class DexMethod(object):
   
 class DexProto(object):
   def __init__(self, shorty, return_type, params):
+    self._hash = None
     self.shorty = shorty
     self.return_type = return_type
     self.parameters = params
   def __hash__(self):
-    return hash(self.return_type + "".join(self.parameters))
+    if self._hash is None:
+      self._hash = hash(self.return_type + "".join(self.parameters))
+    return self._hash
   def __eq__(self,othr):
     if hash(self) == hash(othr):
       return True
@@ -367,7 +560,8 @@ class DexValue(object):
     if encoded_type in [VALUE_TYPE_BYTE, VALUE_TYPE_ARRAY, VALUE_TYPE_ANNOTATION, VALUE_TYPE_NULL]:
       value_arg = 0
     if encoded_type == VALUE_TYPE_BOOLEAN:
-      value_arg = 1 if self.value else 0
+      value = self.value.value if isinstance(self.value, DexValue) else self.value
+      value_arg = 1 if value else 0
 
     stream.write_ubyte((((value_arg & 0xffffffff) << 5) | encoded_type))
     if encoded_type in [VALUE_TYPE_BOOLEAN, VALUE_TYPE_NULL]: return
@@ -1,30 +1,56 @@
+from dexassist.writer.dex.refs import DexRefs
+
+# string, type, field and method ids of one dex
+MAX_REF_COUNT = 0x10000
 
 class MultiDexPolicy(object):
+  def reset(self):
+    """
+      called before classes are split again
+    """
+    pass
   def get_multidex_name(self, index):
     raise Exception('get_multidex_name not implemented')
   def get_multidex_index(self, clazz):
     raise Exception('get_multidex_index not implemented')
+  def get_dex_refs(self, index):
+    """
+      DexRefs of classes in dex of index, None to collect them in writer
+    """
+    return None
 
 class DefaultMultiDexPolicy(MultiDexPolicy):
-  def __init__(self):
-    self.method_count = 0
-    self.string_count = 0
+  """
+    classes are put in order, next dex is started when string, type, field
+    or method ids referenced by the current dex would exceed max_ref_count.
+    a class which exceeds max_ref_count alone gets its own dex
+  """
+  def __init__(self, max_ref_count=MAX_REF_COUNT):
+    self.max_ref_count = max_ref_count
+    self.reset()
+  def reset(self):
     self.index = 1
+    self.refs = {self.index: DexRefs()}
+    # classes put in each dex
+    self.class_counts = {self.index: 0}
   def next_dex(self):
-    self.method_count = 0
-    self.string_count = 0
     self.index += 1
+    self.refs[self.index] = DexRefs()
+    self.class_counts[self.index] = 0
   def get_multidex_name(self, index):
     return 'classes.dex' if index == 1 else 'classes{}.dex'.format(index)
 
   def get_multidex_index(self, clazz):
-    clazz_method_count = len(clazz.methods)
-    clazz_string_count = len(clazz.get_ref_strings())
-    if self.method_count + clazz_method_count >= 65535:
-      self.next_dex()
-    if self.string_count + clazz_string_count >= 65535:
+    class_refs = DexRefs()
+    class_refs.add_class(clazz)
+    refs = self.refs[self.index]
+    # empty dex takes the class even if it is over the limit
+    if self.class_counts[self.index] and refs.get_merged_count(class_refs) > self.max_ref_count:
       self.next_dex()
-    self.method_count += clazz_method_count
-    self.string_count += clazz_string_count
+      refs = self.refs[self.index]
+    refs.update(class_refs)
+    self.class_counts[self.index] += 1
+    return self.index
 
-    return self.index
\ No newline at end of file
+  def get_dex_refs(self, index):
+    return self.refs.get(index)
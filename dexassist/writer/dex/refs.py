@@ -0,0 +1,281 @@
+"""
+references of classes
+
+DexRefs collects the ids(strings, types, protos, fields, methods, type lists)
+which classes need in their dex, including members of other classes
+referenced by code, annotations and static values.
+it has the externel_* lists of DexManager, so a dex of some classes
+is written with DexRefs in place of the manager of the whole dex.
+ReferenceCollector walks the same way to fill the sections of a dex.
+"""
+from dexassist.normalize import DexValue
+from dexassist.normalize import VALUE_TYPE_ARRAY, VALUE_TYPE_ANNOTATION, VALUE_TYPE_STRING, VALUE_TYPE_TYPE
+from dexassist.normalize import VALUE_TYPE_ENUM, VALUE_TYPE_FIELD, VALUE_TYPE_METHOD, VALUE_TYPE_METHOD_TYPE
+from dexassist.bytecodes.base import INSTRUCT_TYPE_STRING, INSTRUCT_TYPE_TYPE, INSTRUCT_TYPE_FIELD, INSTRUCT_TYPE_METHOD
+from dexassist.bytecodes.base import INVOKE_TABLE, INVOKE_POLYMORPHIC
+from .remap import REF_TYPES
+from .section import SECTION_STRING, SECTION_TYPE, SECTION_PROTO, SECTION_FIELD, SECTION_METHOD
+from .section import SECTION_TYPE_LIST, SECTION_CLASS, SECTION_ANNOTATION_SET, SECTION_ENCODED_ARRAY
+
+ITEM_REF_TYPES = [INSTRUCT_TYPE_STRING, INSTRUCT_TYPE_TYPE, INSTRUCT_TYPE_FIELD, INSTRUCT_TYPE_METHOD]
+
+def get_class_type(item):
+  try:
+    return item.clazz.type
+  except:
+    return item.clazz
+
+class DexRefs(object):
+  def __init__(self):
+    self.strings = set()
+    self.types = set()
+    self.protos = set()
+    self.fields = set()
+    self.methods = set()
+    self.type_lists = set()
+
+  # external references of DexManager
+  @property
+  def externel_string_list(self):
+    return self.strings
+  @property
+  def externel_type_list(self):
+    return self.types
+  @property
+  def externel_proto_list(self):
+    return self.protos
+  @property
+  def externel_field_list(self):
+    return self.fields
+  @property
+  def externel_method_list(self):
+    return self.methods
+  @property
+  def externel_type_list_list(self):
+    return self.type_lists
+
+  def update(self, other):
+    self.strings.update(other.strings)
+    self.types.update(other.types)
+    self.protos.update(other.protos)
+    self.fields.update(other.fields)
+    self.methods.update(other.methods)
+    self.type_lists.update(other.type_lists)
+
+  def get_merged_count(self, other):
+    """
+      largest id count of string, type, field and method after update(other)
+    """
+    return max(
+      len(self.strings) + len(other.strings - self.strings),
+      len(self.types) + len(other.types - self.types),
+      len(self.fields) + len(other.fields - self.fields),
+      len(self.methods) + len(other.methods - self.methods)
+    )
+
+  def add_type(self, type_name):
+    if type_name is None: return
+    self.types.add(type_name)
+    self.strings.add(type_name)
+
+  def add_type_list(self, types):
+    if not types: return
+    types = tuple(types)
+    self.type_lists.add(types)
+    for x in types:
+      self.add_type(x)
+
+  def add_proto(self, proto):
+    self.protos.add(proto)
+    self.strings.add(proto.shorty)
+    self.add_type(proto.return_type)
+    self.add_type_list(proto.parameters)
+
+  def add_field(self, field):
+    if field in self.fields: return
+    self.fields.add(field)
+    self.add_type(get_class_type(field))
+    self.add_type(field.type)
+    self.strings.add(field.name)
+
+  def add_method(self, method):
+    if method in self.methods: return
+    self.methods.add(method)
+    self.add_type(method.clazz.type)
+    self.strings.add(method.name)
+    self.add_proto(method.proto)
+
+  def add_annotation(self, ann):
+    self.add_type(ann.type)
+    for elem in ann.elements:
+      self.strings.add(elem[0])
+      self.add_value(elem[1])
+
+  def add_annotations(self, annotations):
+    """
+      annotation set or list of annotation sets(parameter annotations)
+    """
+    for ann in annotations:
+      if isinstance(ann, list):
+        for x in ann:
+          if x: self.add_annotation(x)
+      elif ann:
+        self.add_annotation(ann)
+
+  def add_value(self, value):
+    """
+      as SectionManager.add_encoded_value
+    """
+    if isinstance(value, list):
+      for v in value:
+        self.add_value(v)
+      return
+    if not isinstance(value, DexValue):
+      value = DexValue(value)
+    value_type = value.get_type()
+    if value_type == VALUE_TYPE_ARRAY:
+      for v in value.value:
+        self.add_value(v)
+    elif value_type == VALUE_TYPE_ANNOTATION:
+      self.add_annotation(value.value)
+    elif value_type == VALUE_TYPE_STRING:
+      self.strings.add(value.value)
+    elif value_type == VALUE_TYPE_TYPE:
+      self.add_type(value.value)
+    elif value_type in [VALUE_TYPE_ENUM, VALUE_TYPE_FIELD]:
+      self.add_field(value.value)
+    elif value_type == VALUE_TYPE_METHOD:
+      self.add_method(value.value)
+    elif value_type == VALUE_TYPE_METHOD_TYPE:
+      self.add_proto(value.value)
+
+  def add_ref(self, ref_type, item):
+    if ref_type == INSTRUCT_TYPE_STRING:
+      self.strings.add(item)
+    elif ref_type == INSTRUCT_TYPE_TYPE:
+      self.add_type(item)
+    elif ref_type == INSTRUCT_TYPE_FIELD:
+      self.add_field(item)
+    elif ref_type == INSTRUCT_TYPE_METHOD:
+      self.add_method(item)
+
+  def add_code(self, method):
+    code = method.get_raw_code()
+    if code is not None and code.get_refs() is not None:
+      # without decoding
+      for op, item in code.get_ref_items():
+        self.add_ref(REF_TYPES[op], item)
+      tries = code.get_try_blocks()
+    else:
+      editor = method.get_editor()
+      if not editor: return
+      for opcode in editor.opcode_list:
+        if INVOKE_TABLE[opcode.op] & INVOKE_POLYMORPHIC:
+          item = opcode.get_item()
+          self.add_method(item[0])
+          self.add_proto(item[1])
+        elif opcode.ref_type in ITEM_REF_TYPES:
+          self.add_ref(opcode.ref_type, opcode.get_item())
+      tries = editor.tries
+    for tryblock in tries:
+      for handler in tryblock.catch_handlers:
+        self.add_type(handler.exception_type)
+
+  def add_param_annotations(self, param_annotations):
+    self.add_annotations(param_annotations)
+
+  def add_static_values(self, values):
+    self.add_value(values)
+
+  def add_class(self, clazz):
+    self.add_type(clazz.type)
+    self.add_type(clazz.superclass)
+    self.add_type_list(clazz.interfaces)
+    if clazz.source_file_name is not None:
+      self.strings.add(clazz.source_file_name)
+    self.add_annotations(clazz.annotations)
+    if clazz.static_initializers:
+      self.add_static_values(clazz.static_initializers)
+    for field in clazz.fields:
+      self.add_field(field)
+      self.add_annotations(field.annotations)
+    for method in clazz.methods:
+      self.add_method(method)
+      self.add_annotations(method.annotations)
+      if method.param_annotations:
+        self.add_param_annotations(method.param_annotations)
+      self.add_code(method)
+
+  def add_externel(self, manager):
+    """
+      external references of DexManager(or DexRefs)
+    """
+    for x in manager.externel_string_list:
+      self.strings.add(x)
+    for x in manager.externel_type_list:
+      self.add_type(x)
+    for x in manager.externel_proto_list:
+      self.add_proto(x)
+    for x in manager.externel_field_list:
+      self.add_field(x)
+    for x in manager.externel_method_list:
+      self.add_method(x)
+    for x in manager.externel_type_list_list:
+      self.add_type_list(x)
+
+
+class ReferenceCollector(DexRefs):
+  """
+    fills sections of SectionManager in one walk over classes.
+    ids are gathered as DexRefs and added to sections at the end,
+    code goes to sections through build_code_item_section(index remap of
+    undecoded code), annotation sets and static values are added when visited.
+  """
+  def __init__(self, section_manager):
+    super(ReferenceCollector, self).__init__()
+    self.section_manager = section_manager
+    self.annotation_set_section = section_manager.get_section(SECTION_ANNOTATION_SET)
+    self.encoded_array_section = section_manager.get_section(SECTION_ENCODED_ARRAY)
+    self.class_section = section_manager.get_section(SECTION_CLASS)
+
+  def add_annotations(self, annotations):
+    super(ReferenceCollector, self).add_annotations(annotations)
+    if annotations:
+      self.annotation_set_section.add_item(annotations)
+
+  def add_param_annotations(self, param_annotations):
+    super(ReferenceCollector, self).add_annotations(param_annotations)
+    for ann in param_annotations:
+      self.annotation_set_section.add_item(ann)
+
+  def add_static_values(self, values):
+    self.encoded_array_section.add_item(values)
+
+  def add_code(self, method):
+    self.section_manager.build_code_item_section(method)
+    self.section_manager.build_debug_info_item_section(method)
+
+  def add_class(self, clazz):
+    self.class_section.add_item(clazz)
+    super(ReferenceCollector, self).add_class(clazz)
+
+  def collect(self, dex_pool, manager):
+    """
+      classes of dex_pool and external references of manager
+    """
+    for clazz in dex_pool:
+      self.add_class(clazz)
+    self.add_externel(manager)
+    self.strings.discard(None)
+    section_manager = self.section_manager
+    for key, items in [
+      (SECTION_STRING, self.strings),
+      (SECTION_TYPE, self.types),
+      (SECTION_PROTO, self.protos),
+      (SECTION_FIELD, self.fields),
+      (SECTION_METHOD, self.methods),
+      (SECTION_TYPE_LIST, self.type_lists)
+    ]:
+      section = section_manager.get_section(key)
+      for item in items:
+        section.add_item(item)
@@ -0,0 +1,125 @@
+"""
+index remapping for undecoded code
+
+index operands of raw code refer to string/type/field/method ids of the dex
+it was parsed from. IndexRemap keeps, for one source DexManager,
+the resolved item and the new index of each old index, so every id is
+resolved and looked up in sections only once, and code is patched in one pass.
+SectionIds stands for the DexManager of code written by incremental save.
+"""
+from array import array
+import sys
+from dexassist.bytecodes.base import REF_TYPE_TABLE, Instruction
+from dexassist.bytecodes.base import INSTRUCT_TYPE_STRING, INSTRUCT_TYPE_TYPE, INSTRUCT_TYPE_FIELD, INSTRUCT_TYPE_METHOD
+from dexassist.writer.dex.section import SECTION_STRING, SECTION_TYPE, SECTION_FIELD, SECTION_METHOD
+
+NO_INDEX = -1
+
+REF_SECTIONS = {
+  INSTRUCT_TYPE_STRING: SECTION_STRING,
+  INSTRUCT_TYPE_TYPE: SECTION_TYPE,
+  INSTRUCT_TYPE_FIELD: SECTION_FIELD,
+  INSTRUCT_TYPE_METHOD: SECTION_METHOD
+}
+
+# ref type of each opcode
+REF_TYPES = REF_TYPE_TABLE
+
+class IndexRemap(object):
+  def __init__(self, section_manager, manager):
+    self.section_manager = section_manager
+    self.manager = manager
+    self.resolver = Instruction(manager)
+    sizes = {
+      INSTRUCT_TYPE_STRING: len(manager.string_list),
+      INSTRUCT_TYPE_TYPE: len(manager.type_list),
+      INSTRUCT_TYPE_FIELD: len(manager.field_list),
+      INSTRUCT_TYPE_METHOD: len(manager.method_list)
+    }
+    self.items = {}
+    self.collected = {}
+    self.indexes = {}
+    for ref_type, size in sizes.items():
+      self.items[ref_type] = [None] * size
+      self.collected[ref_type] = bytearray(size)
+      self.indexes[ref_type] = array('l', [NO_INDEX]) * size
+
+  def get_item(self, op, value):
+    """
+      item of old index, resolved once
+    """
+    items = self.items[REF_TYPES[op]]
+    item = items[value]
+    if item is None:
+      item = self.resolver.get_typeindex_item(op, value)
+      items[value] = item
+    return item
+
+  def collect(self, code):
+    """
+      add referenced items of code to sections, once for each old index
+    """
+    for index, units, op, value in code.get_refs():
+      ref_type = REF_TYPES[op]
+      collected = self.collected[ref_type]
+      if collected[value]: continue
+      collected[value] = 1
+      item = self.get_item(op, value)
+      self.section_manager.get_section(REF_SECTIONS[ref_type]).add_item(item)
+      if ref_type == INSTRUCT_TYPE_TYPE:
+        self.section_manager.get_section(SECTION_STRING).add_item(item)
+
+  def get_index(self, op, value):
+    """
+      new index of old index, sections should be frozen
+    """
+    ref_type = REF_TYPES[op]
+    indexes = self.indexes[ref_type]
+    ret = indexes[value]
+    if ret == NO_INDEX:
+      section = self.section_manager.get_section(REF_SECTIONS[ref_type])
+      ret = section.get_item_index(self.get_item(op, value))
+      indexes[value] = ret
+    return ret
+
+  def patch(self, code):
+    """
+      returns copy of insns(bytes) with index operands remapped
+    """
+    insns = array('H', code.insns)
+    indexes = self.indexes
+    for index, units, op, value in code.get_refs():
+      item_index = indexes[REF_TYPES[op]][value]
+      if item_index == NO_INDEX:
+        item_index = self.get_index(op, value)
+      if units == 1:
+        if item_index > 0xffff:
+          raise Exception('index {} of {} does not fit in 16 bits'.format(item_index, self.get_item(op, value)))
+        insns[index + 1] = item_index
+      else:
+        insns[index + 1] = item_index & 0xffff
+        insns[index + 2] = item_index >> 16
+    if sys.byteorder == 'big':
+      insns.byteswap()
+    return insns.tobytes()
+
+
+class SectionIds(object):
+  """
+    id tables of written dex from frozen sections,
+    indexes of code rebased on written dex are resolved to the same items
+  """
+  def __init__(self, section_manager):
+    self.string_list = section_manager.get_section(SECTION_STRING).get_items()
+    self.type_list = section_manager.get_section(SECTION_TYPE).get_items()
+    self.field_list = section_manager.get_section(SECTION_FIELD).get_items()
+    self.method_list = section_manager.get_section(SECTION_METHOD).get_items()
+
+  def get_string_by_index(self, index):
+    return self.string_list[index]
+  def get_type(self, index):
+    return self.type_list[index]
+  def get_field_dex_item_by_index(self, index):
+    return self.field_list[index]
+  def get_method_dex_item_by_index(self, index):
+    return self.method_list[index]
@@ -1,5 +1,6 @@
 from collections import OrderedDict
-from dexassist.normalize import DexProto, DexValue, VALUE_TYPE_ARRAY
+from dexassist.normalize import DexProto, DexValue, VALUE_TYPE_ARRAY, VALUE_TYPE_ANNOTATION
+from dexassist.normalize import VALUE_TYPE_FIELD, VALUE_TYPE_ENUM, VALUE_TYPE_METHOD
 SECTION_STRING = 1
 SECTION_TYPE = 2
 SECTION_PROTO = 3
@@ -150,18 +151,21 @@ class ProtoSection(Section):
     self.sort()
 
   def sort(self):
+    # return type index, parameter type indexes
+    type_map = self.section_.type_section.type_map
     d = []
     for index in self.reverse_proto_map:
       f = self.reverse_proto_map[index]
       f.index = index
-      d.append(f)
-    d.sort(key = lambda x : x.return_type + ','.join([str(p) for p in x.parameters]))
+      key = (type_map[f.return_type], tuple([type_map[p] for p in f.parameters]))
+      d.append((key, index, f))
+    d.sort()
 
     self.proto_map = OrderedDict()
     self.reverse_proto_map = {}
 
     self.index = 0
-    for i in d:
+    for key, old_index, i in d:
       self.proto_map[i] = self.index
       self.reverse_proto_map[self.index] = i
       self.index += 1
@@ -202,19 +206,22 @@ class FieldSection(Section):
     self.sort()
 
   def sort(self):
+    # class type index, name index, type index
+    type_map = self.section_.type_section.type_map
+    string_map = self.section_.string_section.string_map
     d = []
     for index in self.reverse_field_map:
       f = self.reverse_field_map[index]
-      clazz_type = self.get_clazz_type(f)
       f.index = index
-      d.append(f)
-    d.sort(key = lambda x : self.get_clazz_type(x) + x.name)
+      key = (type_map[self.get_clazz_type(f)], string_map[f.name], type_map[f.type])
+      d.append((key, index, f))
+    d.sort()
 
     self.field_map = OrderedDict()
     self.reverse_field_map = {}
 
     self.index = 0
-    for i in d:
+    for key, old_index, i in d:
       self.field_map[i] = self.index
       self.reverse_field_map[self.index] = i
       self.index += 1
@@ -251,24 +258,6 @@ class FieldSection(Section):
     return self.field_map[value]
 
 
-def cmp_to_key(mycmp):
-    'Convert a cmp= function into a key= function'
-    class K:
-        def __init__(self, obj, *args):
-            self.obj = obj
-        def __lt__(self, other):
-            return mycmp(self.obj, other.obj) < 0
-        def __gt__(self, other):
-            return mycmp(self.obj, other.obj) > 0
-        def __eq__(self, other):
-            return mycmp(self.obj, other.obj) == 0
-        def __le__(self, other):
-            return mycmp(self.obj, other.obj) <= 0
-        def __ge__(self, other):
-            return mycmp(self.obj, other.obj) >= 0
-        def __ne__(self, other):
-            return mycmp(self.obj, other.obj) != 0
-    return K
 class MethodSection(Section):
   def __init__(self, section_manager):
     self.method_map = OrderedDict()
@@ -276,32 +265,22 @@ class MethodSection(Section):
     self.section_ = section_manager
     self.reverse_method_map = {}
     self.frozen = False
-  def sort_compare(self, x, y):
-    type_section = self.section_.type_section
-    x_clazz_index = type_section.get_item_index(x.clazz.type)
-    y_clazz_index = type_section.get_item_index(y.clazz.type)
-    if x_clazz_index != y_clazz_index:
-      return x_clazz_index - y_clazz_index
-    string_section = self.section_.string_section
-    x_name_index = string_section.get_item_index(x.name)
-    y_name_index = string_section.get_item_index(y.name)
-    if x_name_index != y_name_index:
-      return x_name_index - y_name_index
-    proto_section = self.section_.proto_section
-
-    return proto_section.get_item_index(x.proto) - proto_section.get_item_index(y.proto)
-    #x.clazz.type + x.name + str(x.proto)
   def sort(self):
+    # class type index, name index, proto index
+    type_map = self.section_.type_section.type_map
+    string_map = self.section_.string_section.string_map
+    proto_map = self.section_.proto_section.proto_map
     d = []
     for index in self.reverse_method_map:
       m = self.reverse_method_map[index]
       m.index = index
-      d.append(m)
-    d = sorted(d, key = cmp_to_key(self.sort_compare))
+      key = (type_map[m.clazz.type], string_map[m.name], proto_map[m.proto])
+      d.append((key, index, m))
+    d.sort()
     self.method_map = OrderedDict()
     self.reverse_method_map = {}
     self.index = 0
-    for i in d:
+    for key, old_index, i in d:
       self.method_map[i] = self.index
       self.reverse_method_map[self.index] = i
       self.index += 1
@@ -401,7 +380,7 @@ class TypeListSection(Section):
     return self.type_list_map.values()
   def get_item_index(self, value):
 
-    if isinstance(value, list):
+    if isinstance(value, (list, tuple)):
       value = TypeListItem(value)
     return self.type_index_map[value]   
   def get_types(self, type_list):
@@ -569,24 +548,30 @@ class AnnotationSetSection(Section):
           self.get_section(SECTION_ANNOTATION).add_item(x)
 
   def get_dex_value_hash(self, val):
-    ret = ''
     if isinstance(val, list):
-      for i in val:
-        ret += self.get_dex_value_hash(i)
-      return ret
-    else:
-      return str(val.get_type())
+      return '[' + ','.join([self.get_dex_value_hash(i) for i in val]) + ']'
+    value_type = val.get_type()
+    value = val.value
+    if value_type == VALUE_TYPE_ANNOTATION:
+      value = self.hash(value)
+    elif value_type == VALUE_TYPE_ARRAY:
+      value = self.get_dex_value_hash(value)
+    elif value_type in [VALUE_TYPE_FIELD, VALUE_TYPE_ENUM]:
+      value = '{}->{}:{}'.format(self.section_.field_section.get_clazz_type(value), value.name, value.type)
+    elif value_type == VALUE_TYPE_METHOD:
+      value = '{}->{}{}'.format(value.clazz.type, value.name, value.signature)
+    return '{}:{}'.format(value_type, value)
 
   def hash(self, item):
-    key = ''
+    """
+      key of annotation(set) by its values, equal sets are written once
+    """
     if item is None: return 'None'
     if isinstance(item, list):
-      for x in item:
-        key += self.hash(x)   
-      return key
-    key += item.type_name
+      return '|'.join([self.hash(x) for x in item])
+    key = item.type_name
     for elem in item.elements:
-      key += elem[0] + ',' + self.get_dex_value_hash(elem[1])
+      key += ';' + elem[0] + '=' + self.get_dex_value_hash(elem[1])
     return key
     
 
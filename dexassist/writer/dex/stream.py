@@ -13,6 +13,29 @@ ULONGLONG_FMT = '<Q'
 UBYTE_FMT = '<B'
 BYTE_FMT = '<b'
 
+UINT_STRUCT = struct.Struct(UINT_FMT)
+USHORT_STRUCT = struct.Struct(USHORT_FMT)
+INT_STRUCT = struct.Struct(INT_FMT)
+SHORT_STRUCT = struct.Struct(SHORT_FMT)
+LONGLONG_STRUCT = struct.Struct(LONGLONG_FMT)
+ULONGLONG_STRUCT = struct.Struct(ULONGLONG_FMT)
+
+ADLER_BASE = 65521
+def adler32_combine(adler1, adler2, len2):
+  """
+    adler32 of a + b from adler32 of a, adler32 of b and len(b), as zlib adler32_combine
+  """
+  rem = len2 % ADLER_BASE
+  sum1 = adler1 & 0xffff
+  sum2 = (rem * sum1) % ADLER_BASE
+  sum1 += (adler2 & 0xffff) + ADLER_BASE - 1
+  sum2 += ((adler1 >> 16) & 0xffff) + ((adler2 >> 16) & 0xffff) + ADLER_BASE - rem
+  if sum1 >= ADLER_BASE: sum1 -= ADLER_BASE
+  if sum1 >= ADLER_BASE: sum1 -= ADLER_BASE
+  if sum2 >= ADLER_BASE << 1: sum2 -= ADLER_BASE << 1
+  if sum2 >= ADLER_BASE: sum2 -= ADLER_BASE
+  return sum1 | (sum2 << 16)
+
 MOD_ADLER = 1
 def calc_adler32(data, length):
   a = 1
@@ -24,6 +47,12 @@ def calc_adler32(data, length):
 
 
 class BaseWriteStream(object):
+  # stream offset of buf[0]
+  base = 0
+  # adler32 of bytes from start_checksum to checksum_position
+  checksum = 1
+  checksum_position = None
+
   def __init__(self,buf,base_offset):
     self.position = base_offset
     self.buf = buf
@@ -80,27 +109,46 @@ class BaseWriteStream(object):
 
   def as_byte(self, fmt, value):
     return struct.pack(fmt, value)
-  
+
+  def reserve(self, size):
+    """
+      make room for size bytes at position, returns index of position in buf.
+      buffer grows by doubling, so it is reallocated only a few times
+    """
+    index = self.position - self.base
+    end = index + size
+    buf_size = len(self.buf)
+    if buf_size < end:
+      self.buf.extend(bytes(max(end - buf_size, buf_size)))
+    return index
+
+  def write_struct(self, st, value):
+    st.pack_into(self.buf, self.reserve(st.size), value)
+    self.position += st.size
+
   def write_ubyte(self, value):
-    self.write_byte_array( self.as_byte(UBYTE_FMT, value))
+    if not 0 <= value <= 0xff:
+      raise struct.error('ubyte format requires 0 <= number <= 255')
+    self.buf[self.reserve(1)] = value
+    self.position += 1
 
   def write_short(self, value):
-    self.write_byte_array( self.as_byte(SHORT_FMT, value))
+    self.write_struct(SHORT_STRUCT, value)
 
   def write_ushort(self, value):
-    self.write_byte_array( self.as_byte(USHORT_FMT, value))
+    self.write_struct(USHORT_STRUCT, value)
 
   def write_int(self, value):
-    self.write_byte_array( self.as_byte(INT_FMT, value))
+    self.write_struct(INT_STRUCT, value)
 
   def write_uint(self, value):
-    self.write_byte_array( self.as_byte(UINT_FMT, value))
+    self.write_struct(UINT_STRUCT, value)
 
   def write_ulong(self, value):
-    self.write_byte_array( self.as_byte(ULONGLONG_FMT, value))
+    self.write_struct(ULONGLONG_STRUCT, value)
 
   def write_long(self, value):
-    self.write_byte_array( self.as_byte(LONGLONG_FMT, value))
+    self.write_struct(LONGLONG_STRUCT, value)
 
   def write_string(self, value):
     val = self.encode(value)
@@ -141,16 +189,31 @@ class BaseWriteStream(object):
     self.write_uleb(value + 1)
 
   def write_byte_array(self, byte_arr):
-    if len(self.buf) < self.position + len(byte_arr):
-      extend_bytes = bytearray(self.position + len(byte_arr) - len(self.buf))
-      self.buf += extend_bytes
-    self.buf[self.position : self.position + len(byte_arr)] = byte_arr
-
-    self.position += len(byte_arr)
+    size = len(byte_arr)
+    index = self.reserve(size)
+    self.buf[index : index + size] = byte_arr
+    self.position += size
 
   def set_output_index(self, index):
     self.index = index
 
+  def start_checksum(self):
+    self.checksum = 1
+    self.checksum_position = self.position
+
+  def update_checksum(self):
+    """
+      feed bytes written since last update to checksum, they should be final
+    """
+    if self.checksum_position is None:
+      return
+    start = self.checksum_position - self.base
+    end = self.position - self.base
+    if end > start:
+      with memoryview(self.buf) as view:
+        self.checksum = adler32(view[start:end], self.checksum)
+    self.checksum_position = self.position
+
 
 class OutputStream(BaseWriteStream):
   def __init__(self,buf,base_offset):
@@ -170,6 +233,71 @@ class OutputStream(BaseWriteStream):
     return zeros
 
 
+class FileOutputStream(BaseWriteStream):
+  """
+    sequential stream to seekable binary file.
+    written bytes are kept in buf and flushed to file in chunks,
+    so memory is bounded by chunk_size.
+  """
+  def __init__(self, f, base_offset=0, chunk_size=1 << 20):
+    self.f = f
+    self.position = base_offset
+    self.base = base_offset
+    self.buf = bytearray()
+    self.chunk_size = chunk_size
+
+  def at(self, offset):
+    self.flush()
+    self.position = offset
+    self.base = offset
+
+  def reserve(self, size):
+    if self.position - self.base >= self.chunk_size:
+      self.flush()
+    return super(FileOutputStream, self).reserve(size)
+
+  def flush(self):
+    self.update_checksum()
+    size = self.position - self.base
+    if size:
+      self.f.seek(self.base)
+      with memoryview(self.buf) as view:
+        self.f.write(view[:size])
+    # buf is reused for next chunk
+    self.base = self.position
+
+  def write_at(self, offset, data):
+    """
+      back-patch already flushed bytes
+    """
+    self.f.seek(offset)
+    self.f.write(data)
+
+  def read_chunks(self, offset, end):
+    """
+      flushed bytes from offset to end, chunk by chunk
+    """
+    self.f.seek(offset)
+    while offset < end:
+      data = self.f.read(min(self.chunk_size, end - offset))
+      if not data:
+        raise Exception('unexpected end of file at {}'.format(offset))
+      offset += len(data)
+      yield data
+
+  def get_position(self):
+    return self.position
+
+  def close(self):
+    self.flush()
+
+  def align(self):
+    zeros = (-self.position) & 3
+    if zeros > 0:
+      self.write_byte_array(bytearray(zeros))
+    return zeros
+
+
 class TempOutputStream(BaseWriteStream):
   def __init__(self, buf):
     self.buf = buf
@@ -177,9 +305,11 @@ class TempOutputStream(BaseWriteStream):
   
 
   def write_to(self, stream):
-    stream.write_arrays(self.buf)
+    # buf can be larger than written size
+    with memoryview(self.buf) as view:
+      stream.write_arrays(view[:self.position])
     #stream.buf[stream.position : stream.position + self.position] = self.buf
-    self.buf = bytearray()
+    # buf is kept, next item is written over it without growing again
     self.position = 0
  
   def get_position(self):
@@ -189,7 +319,7 @@ class TempOutputStream(BaseWriteStream):
     pass
 
   def reset(self):
-    pass
+    self.position = 0
 
   def align(self):
     zeros = (-self.get_position()) & 3
@@ -1,15 +1,13 @@
+from dexassist.bytecodes.base import INVOKE_TABLE, INVOKE_STATIC, INVOKE_POLYMORPHIC
+from dexassist.bytecodes.base import OP_INVOKE_POLYMORPHIC, OP_INVOKE_POLYMORPHIC_RANGE
+from dexassist.bytecodes.base import OP_INVOKE_STATIC, OP_INVOKE_STATIC_RANGE
 
-OP_INVOKE_POLYMORPHIC_RANGE = 0xfb
-OP_INVOKE_POLYMORPHIC = 0xfa
-
-OP_INVOKE_STATIC = 0x71
-OP_INVOKE_STATIC_RANGE = 0x77
 class InstructionUtil(object):
 
     @staticmethod
     def is_invoke_polymorphic(opcode):
-        return opcode in [OP_INVOKE_POLYMORPHIC, OP_INVOKE_POLYMORPHIC_RANGE]
+        return INVOKE_TABLE[opcode] & INVOKE_POLYMORPHIC != 0
     
     @staticmethod
     def is_invoke_static(opcode):
-        return opcode in [OP_INVOKE_STATIC, OP_INVOKE_STATIC_RANGE]
+        return INVOKE_TABLE[opcode] & INVOKE_STATIC != 0
@@ -6,18 +6,29 @@ except:
   from .multidex import multidex
   from .section import *
 
-from .util import InstructionUtil
+from dexassist.bytecodes.base import WIDTH_TABLE, REF_TYPE_TABLE, INVOKE_TABLE, INVOKE_STATIC, INVOKE_POLYMORPHIC
 
 from .stream import OutputStream
 from .stream import TempOutputStream
 from .stream import InstructionWriter
-from dexassist.normalize import DexValue, DexMethod, DexField
+from .stream import FileOutputStream, UINT_STRUCT, adler32_combine
+from dexassist.normalize import Dex, DexValue, DexMethod, DexField
+from .remap import IndexRemap, SectionIds
+from dexassist.dex.dex import StreamReader, CodeItem
+from dexassist.dex.converter import RawCode
+from .refs import DexRefs, ReferenceCollector
 import hashlib
+import os
+import shutil
+import tempfile
 import zlib
+from concurrent.futures import ProcessPoolExecutor
 
 NO_INDEX = -1
 NO_OFFSET = 0
 
+FILE_CHUNK_SIZE = 1 << 20
+
 INSTRUCT_TYPE_METHOD = 2
 
 LITTLE_ENDIAN_TAG = 0x12345678
@@ -105,6 +116,13 @@ INSTRUCT_TYPE_METHOD_HANDLE = 8
 INSTRUCT_TYPE_CALL_METHOD = 9
 INSTRUCT_TYPE_CALL_PROTO = 10
 
+def get_uleb_size(value):
+  size = 1
+  while value > 0x7f:
+    size += 1
+    value >>= 7
+  return size
+
 def get_method_register_count(method):
   return get_parameter_register_count(method.parameters, method.is_static())
   
@@ -138,7 +156,7 @@ class SectionManager(object):
   @property
   def string_section(self):
     return self.get_section(SECTION_STRING)
-  def __init__(self, manager):
+  def __init__(self, manager, incremental=False):
     self.section_map = {
       SECTION_STRING: StringSection(self),
       SECTION_TYPE: TypeSection(self),
@@ -154,9 +172,35 @@ class SectionManager(object):
       SECTION_TYPE_LIST: TypeListSection(self)
     }
     self.externel_manager = manager
+    self.incremental = incremental
+    self.remaps = {}
+    # id(method) -> clean code, editor state is compared once per save
+    self.clean_codes = {}
   def get_section(self, key):
     return self.section_map[key]
 
+  def get_raw_code(self, method):
+    """
+      code copied without encoding, incremental save copies also
+      decoded methods which are not dirty
+    """
+    if self.incremental:
+      key = id(method)
+      if key not in self.clean_codes:
+        self.clean_codes[key] = method.get_clean_code()
+      return self.clean_codes[key]
+    return method.get_raw_code()
+
+  def get_remap(self, manager):
+    """
+      index remap of undecoded code parsed by manager
+    """
+    remap = self.remaps.get(id(manager))
+    if remap is None:
+      remap = IndexRemap(self, manager)
+      self.remaps[id(manager)] = remap
+    return remap
+
   def add_encoded_value(self, value):
     if isinstance(value, list):
       for v in value:
@@ -194,111 +238,11 @@ class SectionManager(object):
     elif value.get_type() == VALUE_TYPE_METHOD_TYPE:
       self.get_section(SECTION_PROTO).add_item(value.value.get_protos())
 
-  def build_string_section(self, dex_pool):
-    x = set()
-    section = self.get_section(SECTION_STRING)
-    for clazz in dex_pool:
-      p = clazz.get_related_strings()
-      x.update(p)
-    for string_ in self.externel_manager.externel_string_list:
-      x.add(string_)
-    if None in x:
-      x.remove(None)
-    x = list(x)
-    x.sort()
-    for strings in x:
-      section.add_item(strings)
-
-  def build_type_section(self, dex_pool):
-    section = self.get_section(SECTION_TYPE)
-    str_section = self.get_section(SECTION_STRING)
-    type_list = set()
-    for clazz in dex_pool:
-      type_list.add(clazz.type)
-      type_list.update(clazz.interfaces)
-      
-      for field in clazz.fields:
-        type_list.add(field.type)
-        for ann in field.annotations:
-          type_list.add(ann.type)
-
-      for method in clazz.methods:
-        type_list.add(method.return_type)
-        for parameter in method.params:
-          type_list.add(parameter)
-        for ann in method.annotations:
-          type_list.add(ann.type)
-        if method.param_annotations:
-          for ann_list in method.param_annotations:
-            if ann_list:
-              for ann in ann_list:
-                type_list.add(ann.type)
-      for ann in clazz.annotations:
-        type_list.add(ann.type)
-
-    for type_ in self.externel_manager.externel_type_list:
-      type_list.add(type_)
-    x = list(type_list)
-    x.sort()
-    for types in x:
-      section.add_item(types)
-      str_section.add_item(types)
-
-  def build_proto_section(self, dex_pool):
-    section = self.get_section(SECTION_PROTO)
-    string_section = self.get_section(SECTION_STRING)
-    proto_list = set()
-    for clazz in dex_pool:
-      for method in clazz.methods:
-        proto_list.add(method.proto)
-    for proto_ in self.externel_manager.externel_proto_list:
-      proto_list.add(proto_)
-      
-    
-    x = list(proto_list)
-    for protos in x:
-      section.add_item(protos)
-      string_section.add_item(protos.shorty)
-      string_section.add_item(protos.return_type)
-      for param in protos.parameters:
-        string_section.add_item(param)
-  def build_field_section(self, dex_pool):
-    section = self.get_section(SECTION_FIELD)
-    field_list = set()
-    for clazz in dex_pool:
-      for field in clazz.fields:
-        field_list.add(field)
-    for field_ in self.externel_manager.externel_field_list:
-      field_list.add(field_)
-    x = list(field_list)
-    initial_values = []
-    for field in x:
-      section.add_item(field)
-
-      if field.annotations:
-        self.get_section(SECTION_ANNOTATION_SET).add_item(field.annotations)
-
-  
-  def build_method_section(self, dex_pool):
-    section = self.get_section(SECTION_METHOD)
-    method_list = set()
-    for clazz in dex_pool:
-      for method in clazz.methods:
-        method_list.add(method)
-    for method_ in self.externel_manager.externel_method_list:
-      method_list.add(method_)
-    x = list(method_list)
-    for method in x:
-      section.add_item(method)
-      self.build_code_item_section(method)
-      self.build_debug_info_item_section(method)
-      if method.annotations:
-        #print('add method annotations! key : {}'.format(self.get_section(SECTION_ANNOTATION_SET).hash(method.annotations)))
-        self.get_section(SECTION_ANNOTATION_SET).add_item(method.annotations)
-      if method.param_annotations:
-        for ann in method.param_annotations:
-          self.get_section(SECTION_ANNOTATION_SET).add_item(ann)
-
+  def collect(self, dex_pool):
+    """
+      fills sections with classes of dex_pool and external references in one walk
+    """
+    ReferenceCollector(self).collect(dex_pool, self.externel_manager)
 
   def get_data_section_offset(self):
     ret = 0x70 # header_item_size
@@ -312,21 +256,6 @@ class SectionManager(object):
     ret += self.get_section(SECTION_METHOD_HANDLE).get_item_count() * METHOD_HANDLE_ITEM_SIZE
     return ret
   
-  def build_class_def_section(self, dex_pool):
-    section = self.get_section(SECTION_CLASS)
-    clazz_list = set()
-    for clazz in dex_pool:
-      clazz_list.add(clazz)
-    for clazz in clazz_list:
-      section.add_item(clazz)
-      #if clazz.annotations:
-        #self.get_section(SECTION_ANNOTATION_SET).add_item(clazz.annotations)
-      #self.get_section(SECTION_ENCODED_ARRAY).add_item(clazz.values)
-      if clazz.annotations:
-        self.get_section(SECTION_ANNOTATION_SET).add_item(clazz.annotations)
-      if clazz.static_initializers:
-        self.get_section(SECTION_ENCODED_ARRAY).add_item(clazz.static_initializers)
-
   def build_call_site_id_section(self, dex_pool): # pass, for reflection
     pass
 
@@ -336,38 +265,32 @@ class SectionManager(object):
   def build_map_list_section(self, dex_pool):
     pass
 
-  def build_type_list_section(self, dex_pool):
-    section = self.get_section(SECTION_TYPE_LIST)
-    clazz_list = set()
-    for clazz in dex_pool:
-      section.add_item(clazz.interfaces)
-      for method in clazz.methods:
-        section.add_item(method.proto.parameters)
-
-    for type_list_ in self.externel_manager.externel_type_list_list:
-      section.add_item(type_list_)
-
-
-
   def build_code_item_section(self, method):
+    code = self.get_raw_code(method)
+    if code is not None and code.get_refs() is not None:
+      self.build_raw_code_item_section(code)
+      return
     if method.get_editor() == 0: return
     if method.get_editor() is None: return
 
+    ref_types = REF_TYPE_TABLE
     for code in method.get_editor().opcode_list:  
+      ref_type = ref_types[code.op]
+      if ref_type == -1: continue
       item = code.get_item()
-      if code.op == 0xfb:
+      if INVOKE_TABLE[code.op] & INVOKE_POLYMORPHIC:
         self.get_section(SECTION_METHOD).add_item(item[0])
         self.get_section(SECTION_PROTO).add_item(item[1])
-      elif code.ref_type == INSTRUCT_TYPE_STRING:
+      elif ref_type == INSTRUCT_TYPE_STRING:
         self.get_section(SECTION_STRING).add_item(item)
-      elif code.ref_type == INSTRUCT_TYPE_TYPE:
+      elif ref_type == INSTRUCT_TYPE_TYPE:
         self.get_section(SECTION_TYPE).add_item(item)
         self.get_section(SECTION_STRING).add_item(item)
-      elif code.ref_type == INSTRUCT_TYPE_FIELD:
+      elif ref_type == INSTRUCT_TYPE_FIELD:
         self.get_section(SECTION_FIELD).add_item(item)
-      elif code.ref_type == INSTRUCT_TYPE_METHOD:
+      elif ref_type == INSTRUCT_TYPE_METHOD:
         self.get_section(SECTION_METHOD).add_item(item)
-      elif code.ref_type == INSTRUCT_TYPE_CALL_SITE:
+      elif ref_type == INSTRUCT_TYPE_CALL_SITE:
         self.get_section(SECTION_CALL_SITE).add_item(item)
         
     tries = method.get_try_blocks()
@@ -381,6 +304,18 @@ class SectionManager(object):
 
 
 
+  def build_raw_code_item_section(self, code):
+    """
+      references of undecoded code
+    """
+    self.get_remap(code.manager).collect(code)
+
+    for tryblock in code.get_try_blocks():
+      for handler in tryblock.catch_handlers:
+        if handler.exception_type:
+          self.get_section(SECTION_TYPE).add_item(handler.exception_type)
+          self.get_section(SECTION_STRING).add_item(handler.exception_type)
+
   def build_debug_info_item_section(self, method):
     pass
 
@@ -391,12 +326,35 @@ class SectionManager(object):
     pass
   
 
+def build_dex_buffer(dex, writer_class, incremental=False):
+  """
+    dex buffer of one partition, run in worker process
+  """
+  stream = OutputStream(bytearray(), 0)
+  writer_class(dex, incremental=incremental).write(stream)
+  return stream.buf
+
 class DexWriter(object):
-  def __init__(self, dex_class_pool):
-    self.manager = SectionManager(dex_class_pool.manager)
+  """
+    with incremental, only dirty methods(see DexMethod.is_dirty) are encoded,
+    others are copied from their code with index operands remapped.
+    written code is kept in methods, so next save copies it again
+    until the method is changed.
+    ```
+    writer = DexWriter(dex, incremental=True)
+    writer.write_to_file(path)
+    method.editor.insert_before(opcode, [new_opcode])
+    method.editor.commit()
+    DexWriter(dex, incremental=True).write_to_file(path)
+    ```
+  """
+  def __init__(self, dex_class_pool, multidex_policy=None, incremental=False):
+    self.manager = SectionManager(dex_class_pool.manager, incremental)
+    self.incremental = incremental
     self.dex_class_pool = dex_class_pool
-    self.multidex_policy = multidex.DefaultMultiDexPolicy()
-    self.dex_pool_dict = {}
+    if multidex_policy is None:
+      multidex_policy = multidex.DefaultMultiDexPolicy()
+    self.multidex_policy = multidex_policy
     self.string_index_section_offset = NO_OFFSET
     self.type_section_offset = NO_OFFSET
     self.proto_section_offset = NO_OFFSET
@@ -427,32 +385,91 @@ class DexWriter(object):
     self.param_annotation_offset_map = {}
 
   def write(self, stream):
+    """
+      write all classes to one dex, see write_multidex for more than 64K references
+    """
+    for clazz in self.dex_class_pool.classes:
+      clazz.fix()
+    self.build_dex(self.dex_class_pool.classes, stream)
+
+  def get_multidex(self):
+    """
+      classes split by multidex policy, returns list of (dex name, Dex).
+      each Dex has DexRefs of its classes as manager, so it is written alone
+    """
+    dex_pool_dict = {}
+    self.multidex_policy.reset()
     for clazz in self.dex_class_pool.classes:
       clazz.fix()
       index = self.multidex_policy.get_multidex_index(clazz)
-      index = 1
-      if index not in self.dex_pool_dict:
-        self.dex_pool_dict[index] = []
-      self.dex_pool_dict[index].append(clazz)
+      if index not in dex_pool_dict:
+        dex_pool_dict[index] = []
+      dex_pool_dict[index].append(clazz)
+
+    ret = []
+    for index in sorted(dex_pool_dict):
+      refs = self.multidex_policy.get_dex_refs(index)
+      if refs is None:
+        refs = DexRefs()
+        for clazz in dex_pool_dict[index]:
+          refs.add_class(clazz)
+      dex = Dex(refs)
+      for clazz in dex_pool_dict[index]:
+        dex.add_class(clazz)
+      ret.append((self.multidex_policy.get_multidex_name(index), dex))
+    return ret
 
-    for dex_pool_index in self.dex_pool_dict:
-      stream.set_output_index(index)
-      self.build_dex(self.dex_pool_dict[dex_pool_index], stream)
-      #stream.save()
+  def build_multidex(self, max_workers=None):
+    """
+      returns list of (dex name, dex buffer).
+      each partition is sent to worker process by pickle and built there
+    """
+    partitions = self.get_multidex()
+    if len(partitions) <= 1 or max_workers == 1:
+      return [(name, build_dex_buffer(dex, self.__class__, self.incremental)) for name, dex in partitions]
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+      futures = [(name, executor.submit(build_dex_buffer, dex, self.__class__, self.incremental)) for name, dex in partitions]
+      return [(name, x.result()) for name, x in futures]
+
+  def write_multidex(self, directory, max_workers=None):
+    """
+      write classes.dex, classes2.dex, ... to directory, returns written names.
+      with max_workers=1, dex files are built one by one and streamed
+    """
+    names = []
+    if max_workers == 1:
+      for name, dex in self.get_multidex():
+        self.__class__(dex, incremental=self.incremental).write_to_file(os.path.join(directory, name))
+        names.append(name)
+      return names
+    for name, buf in self.build_multidex(max_workers):
+      with open(os.path.join(directory, name), 'wb') as f:
+        f.write(buf)
+      names.append(name)
+    return names
+
+  def write_multidex_to_zip(self, zip_file, max_workers=None):
+    """
+      write classes.dex, classes2.dex, ... to zip entries, returns written names
+    """
+    names = []
+    if max_workers == 1:
+      for name, dex in self.get_multidex():
+        self.__class__(dex, incremental=self.incremental).write_to_zip(zip_file, name)
+        names.append(name)
+      return names
+    for name, buf in self.build_multidex(max_workers):
+      zip_file.writestr(name, buf)
+      names.append(name)
+    return names
 
   def build_dex(self, dex_pool, stream):
     manager = self.manager
     
-    manager.build_string_section(dex_pool)
-    manager.build_type_section(dex_pool)
-    manager.build_proto_section(dex_pool)
-    manager.build_field_section(dex_pool)
-    manager.build_method_section(dex_pool)
-    manager.build_class_def_section(dex_pool)
+    manager.collect(dex_pool)
     manager.build_call_site_id_section(dex_pool) # pass, for reflection
     manager.build_method_handle_section(dex_pool) # pass, for reflection
     manager.build_map_list_section(dex_pool)
-    manager.build_type_list_section(dex_pool)
     #manager.build_annotation_section(dex_pool)
     #manager.build_annotation_set_section(dex_pool)
     manager.build_hiddenapi_class_data_item_section(dex_pool)
@@ -460,30 +477,48 @@ class DexWriter(object):
       manager.section_map[x].freeze()
 
     data_section_offset = manager.get_data_section_offset()
-    buf = bytearray()
+    data_size_estimate = self.estimate_data_size()
+    if isinstance(stream, FileOutputStream):
+      # only header and id sections are kept in memory, data is streamed
+      buf = bytearray(data_section_offset)
+      offset_writer = stream
+      offset_writer.at(data_section_offset)
+    else:
+      # allocated once, grows only when the estimate is short
+      buf = stream.buf
+      del buf[:]
+      buf.extend(bytes(data_section_offset + data_size_estimate))
+      offset_writer = OutputStream(buf, data_section_offset)
+    # data section is final once written, its checksum is updated section by section
+    offset_writer.start_checksum()
     header_writer = OutputStream(buf, 0)
     index_writer = OutputStream(buf, SIZE_HEADER_ITEM)
     print('data section offset : ' + str(data_section_offset))
-    offset_writer = OutputStream(buf, data_section_offset)
     
     self.write_strings(index_writer, offset_writer)
     offset_writer.align()
     assert(offset_writer.position % 4 == 0)
+    offset_writer.update_checksum()
     self.write_types(index_writer)
     offset_writer.align()
     assert(offset_writer.position % 4 == 0)
+    offset_writer.update_checksum()
     self.write_type_lists(offset_writer)
     offset_writer.align()
     assert(offset_writer.position % 4 == 0)
+    offset_writer.update_checksum()
     self.write_protos(index_writer)
     offset_writer.align()
     assert(offset_writer.position % 4 == 0)
+    offset_writer.update_checksum()
     self.write_fields(index_writer)
     offset_writer.align()
     assert(offset_writer.position % 4 == 0)
+    offset_writer.update_checksum()
     self.write_methods(index_writer)
     offset_writer.align()
     assert(offset_writer.position % 4 == 0)
+    offset_writer.update_checksum()
 
     method_handle_writer = OutputStream(buf, index_writer.get_position() + 
       manager.get_section(SECTION_CLASS).get_item_count() * CLASS_DEF_ITEM_SIZE +
@@ -496,6 +531,7 @@ class DexWriter(object):
     self.write_encoded_arrays(offset_writer)
     offset_writer.align()
     assert(offset_writer.position % 4 == 0)
+    offset_writer.update_checksum()
 
     call_site_writer = OutputStream(buf, index_writer.get_position() + 
       manager.get_section(SECTION_CLASS).get_item_count() * CLASS_DEF_ITEM_SIZE)
@@ -505,49 +541,144 @@ class DexWriter(object):
     self.write_annotations(offset_writer)
     offset_writer.align()
     assert(offset_writer.position % 4 == 0)
+    offset_writer.update_checksum()
     self.write_annotation_sets(offset_writer)
     offset_writer.align()
     assert(offset_writer.position % 4 == 0)
+    offset_writer.update_checksum()
     self.write_annotation_set_refs(offset_writer, dex_pool)
     offset_writer.align()
     assert(offset_writer.position % 4 == 0)
+    offset_writer.update_checksum()
     self.write_annotation_directories(offset_writer, dex_pool)
     offset_writer.align()
     assert(offset_writer.position % 4 == 0)
+    offset_writer.update_checksum()
     self.write_debug_and_code_items(offset_writer, TempOutputStream(bytearray()))
     offset_writer.align()
     assert(offset_writer.position % 4 == 0)
+    offset_writer.update_checksum()
     self.write_classes(index_writer, offset_writer)
     offset_writer.align()
     assert(offset_writer.position % 4 == 0)
+    offset_writer.update_checksum()
     self.write_map_item(offset_writer)
     offset_writer.align()
     assert(offset_writer.position % 4 == 0)
-    self.write_header(header_writer, data_section_offset, len(buf))
+    offset_writer.update_checksum()
+    file_size = offset_writer.get_position()
+    if isinstance(stream, FileOutputStream):
+      offset_writer.flush()
+      self.write_header(header_writer, data_section_offset, file_size)
+      self.finish_file(stream, buf, file_size)
+      return
+    del buf[file_size:]
+    stream.position = file_size
+    self.write_header(header_writer, data_section_offset, file_size)
     #header_writer.close()
     #index_writer.close()
     #offset_writer.close()
 
     self.update_signature(buf)
-    self.update_check_sum(buf)
+    self.update_check_sum(buf, data_section_offset, offset_writer.checksum)
+
+  def finish_file(self, stream, head, file_size):
+    """
+      back-patch header and id sections(head), then signature and checksum.
+      data checksum was updated while flushing, but sha1 starts with head
+      which is final only now, so data is read back once for signature.
+    """
+    data_offset = len(head)
+    sha = hashlib.sha1()
+    with memoryview(head) as view:
+      sha.update(view[32:])
+    for chunk in stream.read_chunks(data_offset, file_size):
+      sha.update(chunk)
+    head[12:32] = sha.digest()
+    self.update_check_sum(head, data_offset, stream.checksum, file_size - data_offset)
+    stream.write_at(0, head)
+
+  def write_to_file(self, f):
+    """
+      write dex to path or seekable binary file opened for read and write(w+b)
+      ```
+      DexWriter(dex).write_to_file('classes.dex')
+      ```
+    """
+    if isinstance(f, str):
+      with open(f, 'w+b') as fp:
+        return self.write_to_file(fp)
+    stream = FileOutputStream(f)
+    self.write(stream)
+    f.truncate(stream.get_position())
+
+  def write_to_zip(self, zip_file, name):
+    """
+      write dex to zip entry through temporary file
+      ```
+      with zipfile.ZipFile('out.apk', 'a') as z:
+        DexWriter(dex).write_to_zip(z, 'classes.dex')
+      ```
+    """
+    with tempfile.TemporaryFile() as f:
+      self.write_to_file(f)
+      f.seek(0)
+      with zip_file.open(name, 'w') as entry:
+        shutil.copyfileobj(f, entry, FILE_CHUNK_SIZE)
 
 
 
   def get_section(self, key):
     return self.manager.get_section(key)
 
+  def estimate_data_size(self):
+    """
+      estimated data section size for allocating output, not exact.
+      string data and code items take most of data section, they are sized here
+      (strings are encoded once and kept for write_strings),
+      other items are estimated from their counts with some margin.
+      output grows if the estimate is short.
+    """
+    encoder = TempOutputStream(None)
+    self.encoded_strings = []
+    size = 0
+    for item in self.get_section(SECTION_STRING).get_items():
+      if item.isascii() and '\x00' not in item:
+        data = item.encode('ascii')
+      else:
+        data = encoder.encode(item)
+      self.encoded_strings.append(data)
+      size += get_uleb_size(len(item)) + len(data) + 1
+    code_size = 0
+    for clazz in self.get_section(SECTION_CLASS).get_items():
+      # class data, annotation directory
+      size += 32 + len(clazz.fields) * 6 + len(clazz.methods) * 8
+      for method in clazz.methods:
+        code = self.manager.get_raw_code(method)
+        if code is not None:
+          code_size += 16 + len(code.insns) * 2 + len(code.tries) * 16
+        elif method.is_decoded() and method.editor:
+          # without code, editor is not decoded here, its edits are not committed
+          editor = method.editor
+          code_size += 16 + editor.get_code_size() + len(editor.tries) * 16
+    # code items are written to a temporary stream first
+    self.code_size_estimate = code_size
+    size += code_size
+    size += self.get_section(SECTION_TYPE_LIST).size() * 8
+    # annotations, encoded arrays, map
+    return size + size // 16
+
   def write_strings(self, index_writer, offset_writer):
     self.string_index_section_offset = index_writer.get_position()
     self.string_data_section_offset = offset_writer.get_position()
     size = 0
-    for item in self.get_section(SECTION_STRING).get_items():
+    for item, data in zip(self.get_section(SECTION_STRING).get_items(), self.encoded_strings):
       size += 1
       item_off = offset_writer.get_position()
       index_writer.write_uint(item_off)
-      string_val = item
 
-      offset_writer.write_uleb(len(string_val))
-      offset_writer.write_string(string_val)
+      offset_writer.write_uleb(len(item))
+      offset_writer.write_byte_array(data)
       offset_writer.write_ubyte(0)
     
 
@@ -565,32 +696,63 @@ class DexWriter(object):
     ehbuf = TempOutputStream(bytearray())
     self.debug_section_offset = offset_writer.get_position()
     # pass write debug section!
-    code_writer = TempOutputStream(bytearray())
+    code_writer = TempOutputStream(bytearray(self.code_size_estimate))
 
     offset_writer.align()
     self.code_section_offset = offset_writer.get_position()
+    # (method, code item offset) of encoded methods
+    encoded = []
 
     for clazz in self.get_section(SECTION_CLASS).get_items():
       direct_methods = clazz.get_direct_methods()
       virtual_methods = clazz.get_virtual_methods()
       for method in direct_methods + virtual_methods:
-        try_blocks = method.get_try_blocks()
-        instructions = method.get_instructions()
         #debug_items = method.get_debug_items()
         #debug_item_offset = write_debug_item(offset_writer, debug_writer,
         #method, debug_items
         #)
         debug_item_offset = 0
-        code_item_offset = self.write_code_item(code_writer, ehbuf, method, try_blocks, instructions, debug_item_offset)
+        code = self.manager.get_raw_code(method)
+        if code is not None and code.get_refs() is not None:
+          # untouched method, insns are copied
+          code_item_offset = self.write_raw_code_item(code_writer, ehbuf, method, code, debug_item_offset)
+        else:
+          if method.get_editor():
+            # labels to offsets, shortest goto
+            method.get_editor().layout()
+          try_blocks = method.get_try_blocks()
+          instructions = method.get_instructions()
+          code_item_offset = self.write_code_item(code_writer, ehbuf, method, try_blocks, instructions, debug_item_offset)
+          encoded.append((method, code_item_offset))
         if code_item_offset != -1:
           method.code_item_offset = code_item_offset + self.code_section_offset
           #print('code item offset is 0x{:08x}'.format(code_item_offset + self.code_section_offset))
         else:
           method.code_item_offset = 0
           #code_offsets.append(CodeItemOffset(method, code_item_offset))
+    if self.incremental:
+      self.rebase_code_items(code_writer, encoded)
     offset_writer.align()
     code_writer.write_to(offset_writer)
 
+  def rebase_code_items(self, code_writer, encoded):
+    """
+      encoded methods keep their code items as written, parsed back from
+      code_writer with ids of this dex, so they are copied by next save
+    """
+    ids = SectionIds(self.manager)
+    reader = StreamReader(code_writer.buf, None)
+    for method, code_item_offset in encoded:
+      code = None
+      if code_item_offset != -1:
+        code = RawCode(ids, CodeItem(None, reader, code_item_offset))
+        if code.get_refs() is None:
+          code = None
+      method.rebase(code)
+    self.manager.clean_codes = {}
+    for clazz in self.get_section(SECTION_CLASS).get_items():
+      clazz.clear_dirty()
+
   def write_code_item(self, code_writer, ehbuf, method, try_blocks, instructions, debug_item_offset):
     if instructions is None and debug_item_offset == 0: return -1
     if len(instructions) == 0 and debug_item_offset == 0: return -1
@@ -619,13 +781,20 @@ class DexWriter(object):
     out_param_count = 0
     code_unit_count = 0
     param_count = 0
+    widths = WIDTH_TABLE
+    ref_types = REF_TYPE_TABLE
+    invoke_flags = INVOKE_TABLE
     for ins in instructions:
-      code_unit_count += ins.get_code_unit_count() #.get_code_unit_count()
-
-      if ins.ref_type == INSTRUCT_TYPE_METHOD:
+      opcode = ins.op
+      width = widths[opcode]
+      if width == 0:
+        # nop or payload
+        width = len(ins) >> 1
+      code_unit_count += width
+
+      if ref_types[opcode] == INSTRUCT_TYPE_METHOD:
         method_ref = ins.ref
-        opcode = ins.get_op()
-        if InstructionUtil.is_invoke_polymorphic(opcode):
+        if invoke_flags[opcode] & INVOKE_POLYMORPHIC:
           if logging:
             print("instruction was(polymorphic) {}".format(opcode))
             print("register count from ins is {}".format(ins.get_register_count()))
@@ -634,7 +803,7 @@ class DexWriter(object):
           if logging:
             print("instruction was {}".format(opcode))
             #paramCount = MethodUtil.getParameterRegisterCount(methodRef, InstructionUtil.isInvokeStatic(opcode));
-          param_count = get_parameter_register_count(method_ref.parameters, InstructionUtil.is_invoke_static(opcode))
+          param_count = get_parameter_register_count(method_ref.parameters, invoke_flags[opcode] & INVOKE_STATIC)
           if logging:
             print("register count from ins.ref is {}".format(param_count))
 
@@ -665,6 +834,34 @@ class DexWriter(object):
       ins_writer.write(ins)
       code_offset += len(ins)#.en(get_code_units()
 
+    self.write_try_blocks(code_writer, ehbuf, try_blocks, code_unit_count)
+    return code_item_offset
+
+  def write_raw_code_item(self, code_writer, ehbuf, method, code, debug_item_offset):
+    """
+      copy insns of undecoded code, only index operands are remapped
+    """
+    if len(code.insns) == 0 and debug_item_offset == 0: return -1
+    self.num_code_item_items += 1
+    code_writer.align()
+    code_item_offset = code_writer.get_position()
+    is_static = method.is_static()
+    method.register_count = max(method.register_count, get_parameter_register_count(method.proto.parameters, is_static))
+    try_blocks = code.get_try_blocks()
+    code_writer.write_ushort(method.register_count) # register
+    code_writer.write_ushort(
+      get_parameter_register_count(method.proto.parameters, is_static)
+    ) # ins
+    code_writer.write_ushort(code.outs_size)
+    code_writer.write_ushort(len(try_blocks))
+    code_writer.write_uint(debug_item_offset)
+    code_writer.write_uint(len(code.insns))
+    code_writer.write_byte_array(self.manager.get_remap(code.manager).patch(code))
+
+    self.write_try_blocks(code_writer, ehbuf, try_blocks, len(code.insns))
+    return code_item_offset
+
+  def write_try_blocks(self, code_writer, ehbuf, try_blocks, code_unit_count):
     if len(try_blocks) > 0:
       code_writer.align() # padding
       #if code_unit_count % 2 == 1: code_writer.write_ushort(0x0000)
@@ -714,7 +911,6 @@ class DexWriter(object):
 
     if ehbuf.get_position() > 0:
       ehbuf.write_to(code_writer)
-    return code_item_offset
 
   def calc_map_list_item_count(self):
     num_items = 2 # header, map_list_item
@@ -858,6 +1054,9 @@ class DexWriter(object):
     self.class_data_section_offset = offset_writer.position
 
     class_section = self.get_section(SECTION_CLASS)
+    # index marks written classes, reset from previous build
+    for x in class_section.get_items():
+      x.index = NO_INDEX
     index = 0
     for x in class_section.get_items():
       index = self.write_class(index_writer, offset_writer, index, x)
@@ -1060,10 +1259,11 @@ class DexWriter(object):
     field_section = self.get_section(SECTION_FIELD)
     method_section = self.get_section(SECTION_METHOD)
     annotation_set_section = self.get_section(SECTION_ANNOTATION_SET)
+    tmp_buffer = TempOutputStream(bytearray())
 
     for clazz in dex_buf:
       #max_size = len(clazz.fields) * 8 + len(clazz.methods) * 16
-      tmp_buffer = TempOutputStream(bytearray())
+      tmp_buffer.reset()
       field_annotations = 0
       method_annotations = 0
       param_annotations = 0
@@ -1166,24 +1366,26 @@ class DexWriter(object):
       offset = 0
     writer.write_uint(offset)
 
-  def update_check_sum(self, buf):
-    from dexassist.writer.dex import stream
-    checksum = zlib.adler32(buf[12:]) & 0xffffffff
-    
-    buf[8:12] = struct.pack(stream.UINT_FMT, checksum)
-
-    
+  def update_check_sum(self, buf, data_offset=None, data_checksum=1, data_size=None):
+    """
+      adler32 from offset 12. with data_checksum of data section,
+      only buf[12:data_offset] is read and the two are combined
+    """
+    if data_offset is None:
+      data_offset = len(buf)
+    if data_size is None:
+      data_size = len(buf) - data_offset
+    with memoryview(buf) as view:
+      checksum = zlib.adler32(view[12:data_offset])
+    if data_size:
+      checksum = adler32_combine(checksum, data_checksum, data_size)
+    UINT_STRUCT.pack_into(buf, 8, checksum & 0xffffffff)
 
   def update_signature(self, buf):
-    from dexassist.writer.dex import stream
     sha = hashlib.sha1()
-    #buf[file_size_offset:file_size_offset + 4] = struct.pack(stream.UINT_FMT, len(buf))
-    sha.update(buf[32:])
-    sig = sha.digest()
-
-    buf[12:32] = sig
-    
-    
+    with memoryview(buf) as view:
+      sha.update(view[32:])
+    buf[12:32] = sha.digest()
 
   def should_create_empty_annotation_set(self):
     return True # we don't make dex, just rebuild dex so assert dex is always valid.
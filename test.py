@@ -1,10 +1,9 @@
-import zipfile, os
+import zipfile, os, shutil
 
-from dexassist.dex import converter, dex
-from dexassist.bytecodes import base
+from dexassist.dex import converter, dex, loader
+from dexassist.bytecodes import base, editor
 from dexassist.writer import dex as writer_dex
 from dexassist.writer.dex.writer import DexWriter
-from dexassist.writer.dex.stream import OutputStream
 def print_dex(dex_path):
   with open(dex_path, 'rb') as f:
     x = f.read()
@@ -23,13 +22,102 @@ def remove_ads(dex_path):
         for opcode in m.editor.opcode_list:
           if opcode.op == 0x70 or opcode.op == 0x76:
             if 'setupAds' in opcode.ref.name: m.editor.remove(opcode)
-  stream = OutputStream(bytearray(), 0)
-  mdex.save_as(DexWriter, stream)
+  DexWriter(mdex).write_to_file('classes.dex')
+
+
+
+def get_instructions(mdex):
+  ret = []
+  for clazz in mdex.classes:
+    for m in clazz.methods:
+      if m.editor:
+        ret.append((clazz.type, m.name, [str(x) for x in m.editor.opcode_list]))
+  return ret
 
-  with open('classes.dex', 'wb') as f:
-    f.write(stream.buf)
+def check_mapped_file(dex_path):
+  """
+    from_mapped_file reads code from mmap, it should decode same as from_file
+  """
+  x = get_instructions(dex.from_file(dex_path, converter.DexConverter()))
+  y = get_instructions(dex.from_mapped_file(dex_path, converter.DexConverter()))
+  if x != y:
+    raise Exception('from_mapped_file decoded {} differently'.format(dex_path))
 
+def check_loader(directory):
+  """
+    loader reads loose dex files by from_mapped_file, classes of earlier dex win
+  """
+  expected = []
+  defined = set()
+  for path, entry in loader.get_dex_entries(directory):
+    mdex = dex.from_file(path, converter.DexConverter())
+    mdex.classes = [x for x in mdex.classes if x.type not in defined]
+    defined.update(x.type for x in mdex.classes)
+    expected.extend(get_instructions(mdex))
+  if get_instructions(loader.load(directory, max_workers=1)) != expected:
+    raise Exception('loader decoded {} differently'.format(directory))
 
+def get_targets(e):
+  """
+    target opcodes of branches, switch payloads and tries as bound by labels
+  """
+  branches = [(x, x.label.target) for x in e.opcode_list if getattr(x, 'label', None) is not None]
+  switches = [(x, [l.target for l in x.labels]) for x in e.opcode_list if getattr(x, 'labels', None) is not None]
+  tries = [(t, t.start_label.target, t.end_label.target, [h.label.target for h in t.catch_handlers]) for t in e.tries]
+  return branches, switches, tries
+
+def check_editor(dex_path):
+  """
+    nops are inserted all over the code, branches, switches and tries should
+    keep their targets, goto should take the shortest form and payloads
+    should be aligned after layout. output should decode to the same opcodes.
+  """
+  from dexassist.writer.dex.stream import OutputStream
+  mdex = dex.from_file(dex_path, converter.DexConverter())
+  widened = 0
+  for clazz in mdex.classes:
+    for m in clazz.methods:
+      e = m.editor
+      if not e: continue
+      branches, switches, tries = get_targets(e)
+      for i, x in enumerate(e.opcode_list):
+        if i % 3 == 0:
+          nops = []
+          for k in range(60):
+            nop = base.Instruction10x(e.manager)
+            nop.op = 0
+            nop.high = 0
+            nops.append(nop)
+          e.insert_after(x, nops)
+      e.layout()
+      e.build_index()
+      targets = e.resolve_targets()
+      for x, target in branches:
+        if targets['branch'][id(x)] is not target:
+          raise Exception('branch target of {} is moved in {}'.format(x, m.name))
+        if x.op in editor.GOTO_FORMS:
+          distance = (e.get_opcode_offset(target) - e.get_opcode_offset(x)) // 2
+          if x.op != editor.get_goto_op(distance):
+            raise Exception('goto of distance {} is {}'.format(distance, hex(x.op)))
+          if x.op != editor.OP_GOTO: widened += 1
+      for x, labels in switches:
+        if [id(t) for t in targets['switch'][id(x.switch)]] != [id(t) for t in labels]:
+          raise Exception('switch targets are moved in {}'.format(m.name))
+        if e.get_opcode_offset(x) % 4 != 0:
+          raise Exception('payload is not aligned in {}'.format(m.name))
+      resolved = dict((id(t), (start, end, handlers)) for t, start, end, handlers in targets['tries'])
+      for t, start, end, handlers in tries:
+        x = resolved[id(t)]
+        if x[0] is not start or x[1] is not end or [id(h) for h in x[2]] != [id(h) for h in handlers]:
+          raise Exception('try range is moved in {}'.format(m.name))
+  if widened == 0:
+    raise Exception('no goto is widened in {}'.format(dex_path))
+  stream = OutputStream(bytearray(), 0)
+  DexWriter(mdex).write(stream)
+  # methods are written in index order
+  output = dex.from_memory(bytes(stream.buf), converter.DexConverter())
+  if sorted(get_instructions(output)) != sorted(get_instructions(mdex)):
+    raise Exception('edited {} is decoded differently'.format(dex_path))
 
 def remake(src, dst):
   with zipfile.ZipFile(src, 'r') as s:
@@ -47,21 +135,19 @@ def smali(out_path):
   os.system('java -jar smali-2.3.4.jar a {} --out test.dex'.format(out_path))
 
 def remake_apk(apk_path, out_apk_path):
-  with zipfile.ZipFile(apk_path, 'r') as f:
-    x = f.read('classes.dex')
-  with open('test.dex', 'rb') as f:
-    buf = f.read()
   remake(apk_path, out_apk_path)
-  
 
   with zipfile.ZipFile(out_apk_path, 'a') as f:
-    
-    f.writestr('classes.dex', buf)
+    with open('test.dex', 'rb') as src, f.open('classes.dex', 'w') as dst:
+      shutil.copyfileobj(src, dst)
   
 
 def main():
   #print_dex('test_binary/classes_mid.dex')
   #print_dex('test_binary/more_large.dex')
+  check_mapped_file('test_binary/classes.dex')
+  check_loader('test_binary')
+  check_editor('test_binary/classes_mid.dex')
   remove_ads('test_binary/classes_mid.dex')
   #duplicate_dex('test_binary/classes.dex')
   #duplicate_dex('test_binary/large.dex')